@@ -0,0 +1,179 @@
+"""
+基于请求成本的准入控制
+按 文档数 × 近似 token 数 估算每个请求的推理成本，并限制每个进程的在途成本总量，
+避免大请求突发时饿死小请求或把进程内存撑爆
+"""
+
+import asyncio
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+_CJK_RUNS = re.compile("[\u2e80-\u9fff\uac00-\ud7af]+")
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str, max_chars: Optional[int] = None) -> int:
+    """
+    近似估算文本的 token 数（不调用 tokenizer）
+
+    中日韩字符大致每个字符一个 token，其它字符按每 4 个字符一个 token 估算。
+
+    Args:
+        text: 文本
+        max_chars: 只统计前 max_chars 个字符（超出部分反正会被截断）
+    """
+    if max_chars is not None:
+        text = text[:max_chars]
+    cjk = 0 if text.isascii() else sum(map(len, _CJK_RUNS.findall(text)))
+    return cjk + (len(text) - cjk + 3) // 4 + 1
+
+
+def estimate_cost(query: str, documents: List[str], max_length: int, limit: Optional[int] = None) -> int:
+    """
+    估算一次重排请求的成本
+
+    Args:
+        query: 查询文本
+        documents: 文档列表
+        max_length: 模型最大序列长度（超出部分会被截断，不计入成本）
+        limit: 只有 limit 个文档会进入 cross-encoder 时（例如启用了预筛选），
+               按成本最高的 limit 个文档保守估算
+
+    Returns:
+        所有 (query, document) 对的近似 token 总数
+    """
+    # 每个字符至少约 1/4 个 token，超过 4 * max_length 个字符的部分一定会被截断
+    max_chars = 4 * max_length
+    query_tokens = estimate_tokens(query, max_chars)
+    costs = [min(max_length, query_tokens + estimate_tokens(doc, max_chars)) for doc in documents]
+    if limit is not None and limit < len(costs):
+        costs = sorted(costs, reverse=True)[:limit]
+    return sum(costs)
+
+
+class AdmissionController:
+    """
+    进程内在途成本预算
+
+    请求先预占成本再执行推理，结束后释放。预算不足时请求排队等待，
+    超过最长等待时间仍无法准入则拒绝。成本小的请求在预算有空隙时可以先被准入，
+    不会被排在前面的大请求阻塞。
+    """
+
+    def __init__(self, max_inflight_cost: int = 0, max_queue_wait: float = 0.0):
+        """
+        Args:
+            max_inflight_cost: 在途成本上限（近似 token 数），0 表示不限制
+            max_queue_wait: 预算不足时最长排队时间（秒），0 表示直接拒绝
+        """
+        self.max_inflight_cost = max_inflight_cost
+        self.max_queue_wait = max_queue_wait
+        self.inflight_cost = 0
+        self.inflight_requests = 0
+        self.queued_requests = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self._condition = None  # 延迟创建，绑定到服务运行的事件循环
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _fits(self, cost: int) -> bool:
+        return self.inflight_cost + cost <= self.max_inflight_cost
+
+    async def acquire(self, cost: int):
+        """预占成本，必要时排队；无法准入时抛出 AdmissionRejected"""
+        if self.max_inflight_cost <= 0:
+            self.inflight_cost += cost
+            self.inflight_requests += 1
+            self.admitted_total += 1
+            return
+
+        if cost > self.max_inflight_cost:
+            self.rejected_total += 1
+            raise AdmissionRejected(
+                413,
+                f"请求成本 {cost} 超过服务端上限 {self.max_inflight_cost}，请减少文档数量或长度"
+            )
+
+        condition = self._get_condition()
+        async with condition:
+            if not self._fits(cost):
+                if self.max_queue_wait <= 0:
+                    self.rejected_total += 1
+                    raise AdmissionRejected(429, "服务繁忙，在途请求成本已达上限")
+
+                self.queued_requests += 1
+                deadline = time.monotonic() + self.max_queue_wait
+                try:
+                    while not self._fits(cost):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_total += 1
+                            raise AdmissionRejected(429, "服务繁忙，排队等待超时")
+                        try:
+                            await asyncio.wait_for(condition.wait(), timeout=remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    self.queued_requests -= 1
+
+            self.inflight_cost += cost
+            self.inflight_requests += 1
+            self.admitted_total += 1
+
+    async def release(self, cost: int):
+        """释放成本并唤醒排队中的请求"""
+        self.inflight_cost -= cost
+        self.inflight_requests -= 1
+        if self.max_inflight_cost > 0:
+            condition = self._get_condition()
+            async with condition:
+                condition.notify_all()
+
+    async def run(self, cost: int, work: Callable[[], Awaitable[T]]) -> T:
+        """
+        占用成本执行 work()，work 真正结束后才释放成本
+
+        调用方被取消（例如 WebSocket 客户端断开）时线程池中的推理仍在运行，
+        因此 work 不随调用方取消，预算也一直占用到推理结束。
+        """
+        await self.acquire(cost)
+        task = asyncio.ensure_future(work())
+
+        def on_done(finished: asyncio.Future):
+            if not finished.cancelled():
+                finished.exception()  # 调用方已取消时避免 "exception was never retrieved" 警告
+            asyncio.ensure_future(self.release(cost))
+
+        task.add_done_callback(on_done)
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        """当前预算与使用情况"""
+        return {
+            "max_inflight_cost": self.max_inflight_cost,
+            "max_queue_wait": self.max_queue_wait,
+            "inflight_cost": self.inflight_cost,
+            "available_cost": (
+                max(0, self.max_inflight_cost - self.inflight_cost) if self.max_inflight_cost > 0 else None
+            ),
+            "inflight_requests": self.inflight_requests,
+            "queued_requests": self.queued_requests,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+        }
@@ -0,0 +1,363 @@
+"""
+批大小与批等待时间自动调优
+按模型分别统计推理吞吐（pairs/s）与批延迟，在运维设定的延迟 SLO 内调整 predict 的批大小，
+以及小请求为凑批而等待的时间：等待期间到达的并发小请求会合并为一次前向计算
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class ModelBatchTuner:
+    """
+    单个模型的调优状态
+
+    每累计 window 次前向批次评估一次：
+        - p95 批延迟（凑批等待 + 单批前向）超过 SLO：先缩短等待时间，已为 0 时减小批大小
+        - 否则对批大小做爬山搜索：试探相邻档位，吞吐提升不足 3% 则退回并暂停试探若干窗口
+        - 并发小请求较多且延迟有余量时逐步加长等待时间，没有可合并的并发请求时缩短
+    """
+
+    IMPROVEMENT = 1.03   # 试探档位吞吐至少提升 3% 才保留
+    SETTLE_WINDOWS = 10  # 试探失败后暂停试探的窗口数
+
+    def __init__(
+        self,
+        batch_sizes: List[int],
+        initial_batch_size: int,
+        max_wait_seconds: float,
+        latency_slo_seconds: float,
+        window: int,
+        enabled: bool = True
+    ):
+        # 关闭调优时固定使用配置的批大小，即使它不在候选档位中
+        self.batch_sizes = sorted(set(batch_sizes) | ({initial_batch_size} if not enabled else set()))
+        self.size_index = min(
+            range(len(self.batch_sizes)), key=lambda i: abs(self.batch_sizes[i] - initial_batch_size)
+        )
+        self.wait_steps = [0.0] + [max_wait_seconds * f for f in (0.125, 0.25, 0.5, 1.0)] if max_wait_seconds > 0 else [0.0]
+        self.wait_index = 0
+        self.latency_slo = latency_slo_seconds
+        self.window = window
+        self.enabled = enabled
+
+        self.throughput_by_size: Dict[int, float] = {}  # 各批大小的吞吐（指数滑动平均）
+        self._direction = 1
+        self._probe_from: Optional[int] = None  # 正在试探时，试探前的档位
+        self._settle = 0
+        self.windows = 0
+        self.adjustments = 0
+        self.last_window: Optional[Dict] = None
+        self.last_adjustment: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._reset_window()
+
+    @property
+    def batch_size(self) -> int:
+        return self.batch_sizes[self.size_index]
+
+    @property
+    def wait_seconds(self) -> float:
+        return self.wait_steps[self.wait_index]
+
+    def _reset_window(self):
+        self._pairs = 0
+        self._compute_seconds = 0.0
+        self._forward_calls = 0
+        self._flushes = 0
+        self._jobs = 0
+        self._small_jobs = 0
+        self._concurrent_small_jobs = 0
+        self._latencies: List[float] = []
+
+    def observe(
+        self,
+        pairs: int,
+        forward_calls: int,
+        compute_seconds: float,
+        queue_waits: List[float],
+        small_jobs: int,
+        concurrent_small_jobs: int
+    ):
+        """
+        记录一次推理（可能合并了多个请求）
+
+        Args:
+            pairs: 送入模型的 pair 数
+            forward_calls: 前向批次数
+            compute_seconds: 推理耗时
+            queue_waits: 每个被合并的请求的凑批等待时间
+            small_jobs: 其中不足一批的请求数
+            concurrent_small_jobs: 其中到达时已有其它请求在推理或排队的小请求数
+        """
+        with self._lock:
+            per_call = compute_seconds / max(1, forward_calls)
+            self._pairs += pairs
+            self._compute_seconds += compute_seconds
+            self._forward_calls += forward_calls
+            self._flushes += 1
+            self._jobs += len(queue_waits)
+            self._small_jobs += small_jobs
+            self._concurrent_small_jobs += concurrent_small_jobs
+            self._latencies.extend(wait + per_call for wait in queue_waits)
+            if self._forward_calls >= self.window:
+                self._evaluate()
+                self._reset_window()
+
+    def _evaluate(self):
+        """一个窗口结束：汇总指标并调整参数"""
+        self.windows += 1
+        size = self.batch_size
+        throughput = self._pairs / self._compute_seconds if self._compute_seconds > 0 else 0.0
+        p95 = _percentile(self._latencies, 95)
+        pairs_per_flush = self._pairs / self._flushes
+        concurrency = self._concurrent_small_jobs / self._small_jobs if self._small_jobs else 0.0
+        previous = self.throughput_by_size.get(size)
+        self.throughput_by_size[size] = throughput if previous is None else 0.7 * previous + 0.3 * throughput
+        self.last_window = {
+            "pairs_per_second": round(throughput, 1),
+            "p95_batch_latency_ms": round(p95 * 1000, 1),
+            "mean_batch_fill": round(min(1.0, pairs_per_flush / size), 3),
+            "jobs_per_flush": round(self._jobs / self._flushes, 2),
+            "concurrent_small_job_ratio": round(concurrency, 3),
+        }
+        if not self.enabled:
+            return
+
+        # 超出 SLO：先缩短等待，再减小批大小
+        if self.latency_slo > 0 and p95 > self.latency_slo:
+            self._probe_from = None
+            if self.wait_index > 0:
+                self._set(wait_index=self.wait_index - 1, reason="p95 批延迟超过 SLO，缩短等待时间")
+            elif self.size_index > 0:
+                self._direction = -1
+                self._set(size_index=self.size_index - 1, reason="p95 批延迟超过 SLO，减小批大小")
+            return
+
+        # 等待时间：只有并发小请求足够多时，等待才能凑出更满的批次
+        if concurrency < 0.2 and self.wait_index > 0:
+            self._set(wait_index=self.wait_index - 1, reason="没有可合并的并发请求，缩短等待时间")
+        elif (
+            concurrency >= 0.5
+            and pairs_per_flush < size
+            and self.wait_index < len(self.wait_steps) - 1
+            and (self.latency_slo <= 0 or p95 + self.wait_steps[self.wait_index + 1] - self.wait_seconds < 0.5 * self.latency_slo)
+        ):
+            self._set(wait_index=self.wait_index + 1, reason="并发小请求较多且延迟有余量，加长等待时间")
+
+        # 批大小：爬山搜索
+        if self._probe_from is not None:
+            base = self.batch_sizes[self._probe_from]
+            if throughput >= self.throughput_by_size.get(base, 0.0) * self.IMPROVEMENT:
+                self._probe_from = None
+                self._log_change(f"批大小 {base} -> {size} 吞吐提升，保留")
+            else:
+                self._direction = -self._direction
+                self._settle = self.SETTLE_WINDOWS
+                self._set(size_index=self._probe_from, reason=f"批大小 {size} 吞吐没有提升，退回")
+                self._probe_from = None
+            return
+        if self._settle > 0:
+            self._settle -= 1
+            return
+
+        target = self.size_index + self._direction
+        if not 0 <= target < len(self.batch_sizes):
+            self._direction = -self._direction
+            target = self.size_index + self._direction
+        if not 0 <= target < len(self.batch_sizes):
+            return
+        if target > self.size_index:
+            # 请求都不足一批时增大批大小没有意义；按比例估算的批延迟也不能超出 SLO
+            estimated = p95 * self.batch_sizes[target] / size
+            if pairs_per_flush <= size or (self.latency_slo > 0 and estimated > self.latency_slo):
+                self._direction = -1
+                self._settle = self.SETTLE_WINDOWS
+                return
+        self._probe_from = self.size_index
+        self._set(size_index=target, reason=f"试探批大小 {self.batch_sizes[target]}")
+
+    def _set(self, size_index: Optional[int] = None, wait_index: Optional[int] = None, reason: str = ""):
+        if size_index is not None:
+            self.size_index = size_index
+        if wait_index is not None:
+            self.wait_index = wait_index
+        self.adjustments += 1
+        self._log_change(reason)
+
+    def _log_change(self, reason: str):
+        self.last_adjustment = {
+            "at": time.time(),
+            "batch_size": self.batch_size,
+            "wait_ms": round(self.wait_seconds * 1000, 2),
+            "reason": reason,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "batch_size": self.batch_size,
+                "wait_ms": round(self.wait_seconds * 1000, 2),
+                "latency_slo_ms": round(self.latency_slo * 1000, 1) if self.latency_slo > 0 else None,
+                "probing": self._probe_from is not None,
+                "windows": self.windows,
+                "adjustments": self.adjustments,
+                "last_window": self.last_window,
+                "last_adjustment": self.last_adjustment,
+                "pairs_per_second_by_batch_size": {
+                    str(size): round(tp, 1) for size, tp in sorted(self.throughput_by_size.items())
+                },
+            }
+
+
+class _Job:
+    """排队等待合并推理的一个请求"""
+
+    def __init__(self, items: List, concurrent: bool):
+        self.items = items
+        self.concurrent = concurrent
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+
+class BatchAutotuner:
+    """
+    按模型名称维护调优状态，并负责小请求的合并推理
+
+    run() 中不足一批的请求进入该模型实例的等待队列：队首请求所在线程作为 leader，
+    等到队列凑满一批或等待时间用完后，把队列中所有请求合并为一次推理，结果分发回各请求。
+    """
+
+    def __init__(
+        self,
+        batch_sizes: List[int],
+        initial_batch_size: int = 32,
+        max_wait_seconds: float = 0.01,
+        latency_slo_seconds: float = 1.0,
+        window: int = 20,
+        enabled: bool = True
+    ):
+        self.batch_sizes = batch_sizes
+        self.initial_batch_size = initial_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.latency_slo_seconds = latency_slo_seconds
+        self.window = window
+        self.enabled = enabled
+        self._tuners: Dict[str, ModelBatchTuner] = {}
+        self._queues: Dict[Tuple[int, Callable], List[_Job]] = {}
+        self._active: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def tuner(self, model_name: str) -> ModelBatchTuner:
+        with self._cond:
+            if model_name not in self._tuners:
+                self._tuners[model_name] = ModelBatchTuner(
+                    self.batch_sizes,
+                    self.initial_batch_size,
+                    self.max_wait_seconds if self.enabled else 0.0,
+                    self.latency_slo_seconds,
+                    self.window,
+                    enabled=self.enabled
+                )
+            return self._tuners[model_name]
+
+    def reset(self, model_name: str):
+        """模型替换后丢弃旧的调优状态"""
+        with self._cond:
+            self._tuners.pop(model_name, None)
+
+    def run(self, model_name: str, model, items: List, score_fn: Callable[..., List[float]]) -> List[float]:
+        """
+        用当前调优参数推理
+
+        Args:
+            model_name: 模型名称（调优状态按名称区分）
+            model: 模型实例
+            items: 推理输入（如 [query, document] 对）
+            score_fn: score_fn(model, items, batch_size) -> 分数列表；不同 score_fn 的输入不会被合并
+
+        Returns:
+            与 items 一一对应的分数列表
+        """
+        tuner = self.tuner(model_name)
+        batch_size, wait = tuner.batch_size, tuner.wait_seconds
+        small = len(items) < batch_size
+
+        with self._cond:
+            concurrent = self._active.get(model_name, 0) > 0
+            self._active[model_name] = self._active.get(model_name, 0) + 1
+        try:
+            if not small or wait <= 0:
+                return self._flush(tuner, model, [_Job(items, concurrent)], score_fn, batch_size, small)
+            return self._enqueue(tuner, model, _Job(items, concurrent), score_fn, batch_size, wait)
+        finally:
+            with self._cond:
+                self._active[model_name] -= 1
+
+    def _enqueue(self, tuner, model, job: _Job, score_fn, batch_size: int, wait: float) -> List[float]:
+        key = (id(model), score_fn)
+        with self._cond:
+            queue = self._queues.setdefault(key, [])
+            queue.append(job)
+            if len(queue) > 1:
+                # 已有 leader 在等待，唤醒它检查是否已凑满
+                self._cond.notify_all()
+                leader = False
+            else:
+                leader = True
+                deadline = job.enqueued_at + wait
+                while sum(len(j.items) for j in queue) < batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                jobs = self._queues.pop(key)
+
+        if not leader:
+            return job.future.result()
+        return self._flush(tuner, model, jobs, score_fn, batch_size, True)
+
+    def _flush(self, tuner, model, jobs: List[_Job], score_fn, batch_size: int, small: bool) -> List[float]:
+        """合并推理一组请求，返回第一个请求（leader 自己）的结果"""
+        started = time.monotonic()
+        items = [item for job in jobs for item in job.items]
+        try:
+            scores = score_fn(model, items, batch_size)
+        except BaseException as e:
+            for job in jobs[1:]:
+                job.future.set_exception(e)
+            raise
+        compute_seconds = time.monotonic() - started
+
+        offset = 0
+        for job in jobs:
+            job.future.set_result(scores[offset:offset + len(job.items)])
+            offset += len(job.items)
+
+        tuner.observe(
+            pairs=len(items),
+            forward_calls=-(-len(items) // batch_size),
+            compute_seconds=compute_seconds,
+            queue_waits=[started - job.enqueued_at for job in jobs],
+            small_jobs=len(jobs) if small else 0,
+            concurrent_small_jobs=sum(job.concurrent for job in jobs) if small else 0
+        )
+        return jobs[0].future.result()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            tuners = dict(self._tuners)
+        return {name: tuner.stats() for name, tuner in tuners.items()}
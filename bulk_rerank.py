@@ -0,0 +1,282 @@
+"""
+离线批量重排工具
+流式读取 JSONL 文件，分片到多个 worker 进程并行打分，增量写出结果并记录断点，
+任务被中断后可以从断点继续
+
+输入每行格式:
+    {"id": "q1", "query": "...", "documents": ["...", "..."], "top_n": 3}
+
+输出每行格式:
+    {"id": "q1", "results": [{"index": 1, "relevance_score": 0.98}, ...]}
+
+用法:
+    python bulk_rerank.py input.jsonl output.jsonl --model BAAI/bge-reranker-base --workers 4
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# worker 进程内的全局状态
+_worker_model = None
+_worker_batch_size = 256
+
+
+def _init_worker(model_name: str, core_groups: List[List[int]], slot_counter, batch_size: int):
+    """worker 初始化：绑定核心、设置线程数并加载模型（复用服务端的加载逻辑）"""
+    global _worker_model, _worker_batch_size
+    import cpu_tuning
+    from rerank_server import load_single_model
+
+    with slot_counter.get_lock():
+        slot = slot_counter.value
+        slot_counter.value += 1
+    cores = core_groups[slot % len(core_groups)]
+    cpu_tuning.apply_thread_settings(intra_op_threads=len(cores), inter_op_threads=1, cores=cores)
+
+    _worker_model = load_single_model(model_name)
+    _worker_batch_size = batch_size
+
+
+def _parse_row(line: str) -> Dict:
+    """
+    解析并校验一行输入
+
+    Raises:
+        ValueError: 字段缺失或类型不对（query 须为字符串，documents 须为字符串列表，top_n 须为整数或 null）
+    """
+    row = json.loads(line)
+    if not isinstance(row, dict):
+        raise ValueError("每行必须是 JSON 对象")
+    if not isinstance(row.get("query"), str):
+        raise ValueError("query 必须是字符串")
+    documents = row.get("documents")
+    if not isinstance(documents, list) or not all(isinstance(doc, str) for doc in documents):
+        raise ValueError("documents 必须是字符串列表")
+    top_n = row.get("top_n")
+    if top_n is not None and (isinstance(top_n, bool) or not isinstance(top_n, int)):
+        raise ValueError("top_n 必须是整数或 null")
+    return row
+
+
+def _score_chunk(rows: List[Tuple[int, str]]) -> List[str]:
+    """
+    对一批输入行打分
+
+    把整批所有 (query, document) 对放在一起按长度排序推理，
+    再拆回各行，按分数降序输出。
+    整批推理失败时逐行重试，只有出错的行输出错误，不影响其余行和整个任务。
+
+    Args:
+        rows: (行号, 原始 JSON 文本) 列表
+
+    Returns:
+        输出 JSON 行列表，与输入一一对应
+    """
+    from rerank_server import score_pairs
+
+    parsed = []
+    pairs = []
+    for line_no, line in rows:
+        try:
+            row = _parse_row(line)
+            parsed.append((line_no, row, len(pairs), len(row["documents"]), None))
+            pairs.extend([row["query"], doc] for doc in row["documents"])
+        except Exception as e:
+            parsed.append((line_no, None, 0, 0, f"无效的输入行: {e}"))
+
+    try:
+        scores = score_pairs(_worker_model, pairs, batch_size=_worker_batch_size) if pairs else []
+    except Exception as e:
+        logger.warning(f"⚠️  整批打分失败，逐行重试: {e}")
+        scores = [None] * len(pairs)
+        for index, (line_no, row, offset, count, error) in enumerate(parsed):
+            if error or count == 0:
+                continue
+            try:
+                scores[offset:offset + count] = score_pairs(
+                    _worker_model, pairs[offset:offset + count], batch_size=_worker_batch_size
+                )
+            except Exception as row_error:
+                parsed[index] = (line_no, row, offset, count, f"打分失败: {row_error}")
+
+    outputs = []
+    for line_no, row, offset, count, error in parsed:
+        if error:
+            row_id = row.get("id", line_no) if row is not None else line_no
+            outputs.append(json.dumps({"id": row_id, "error": error}, ensure_ascii=False))
+            continue
+        results = sorted(
+            ({"index": i, "relevance_score": scores[offset + i]} for i in range(count)),
+            key=lambda r: r["relevance_score"],
+            reverse=True
+        )
+        top_n = row.get("top_n")
+        if top_n is not None and top_n > 0:
+            results = results[:top_n]
+        outputs.append(json.dumps({"id": row.get("id", line_no), "results": results}, ensure_ascii=False))
+    return outputs
+
+
+class CheckpointMismatch(Exception):
+    """断点与当前输入、输出文件不匹配"""
+
+
+def input_fingerprint(input_path: str) -> Dict:
+    """断点对应的输入文件（路径与大小），输入变化后不能从断点继续"""
+    return {"input_path": os.path.abspath(input_path), "input_bytes": os.path.getsize(input_path)}
+
+
+def load_checkpoint(path: str) -> Dict:
+    """读取断点文件，不存在时返回初始状态"""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"rows_done": 0, "output_bytes": 0}
+
+
+def check_resumable(state: Dict, input_path: str, output_path: str):
+    """
+    校验断点与当前输入、输出文件是否匹配
+
+    Raises:
+        CheckpointMismatch: 断点属于其它输入文件、输入文件已变化，或输出文件缺失/短于断点记录
+    """
+    if not state["rows_done"]:
+        return
+    fingerprint = input_fingerprint(input_path)
+    if any(state.get(key) != value for key, value in fingerprint.items()):
+        raise CheckpointMismatch(
+            f"断点记录的输入文件 ({state.get('input_path')}, {state.get('input_bytes')} 字节) "
+            f"与当前输入 ({fingerprint['input_path']}, {fingerprint['input_bytes']} 字节) 不一致"
+        )
+    if not os.path.exists(output_path) or os.path.getsize(output_path) < state["output_bytes"]:
+        raise CheckpointMismatch(f"输出文件 {output_path} 缺失或短于断点记录的 {state['output_bytes']} 字节")
+
+
+def save_checkpoint(path: str, rows_done: int, output_bytes: int, fingerprint: Dict):
+    """原子地写入断点文件"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"rows_done": rows_done, "output_bytes": output_bytes, **fingerprint}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def iter_chunks(input_path: str, skip_rows: int, chunk_rows: int) -> Iterator[List[Tuple[int, str]]]:
+    """流式读取输入文件，跳过已完成的行，按 chunk_rows 分块"""
+    with open(input_path, "r", encoding="utf-8") as f:
+        lines = ((i, line) for i, line in enumerate(f) if line.strip())
+        lines = islice(lines, skip_rows, None)
+        while True:
+            chunk = list(islice(lines, chunk_rows))
+            if not chunk:
+                return
+            yield chunk
+
+
+def run(args) -> int:
+    """执行批量重排，返回本次处理的行数"""
+    import cpu_tuning
+
+    checkpoint_path = args.checkpoint or args.output + ".ckpt"
+    state = load_checkpoint(checkpoint_path)
+    check_resumable(state, args.input, args.output)
+    fingerprint = input_fingerprint(args.input)
+    rows_done = state["rows_done"]
+    if rows_done:
+        logger.info(f"♻️  从断点继续: 已完成 {rows_done} 行")
+
+    # 丢弃上次中断时写了一半的输出
+    mode = "r+b" if rows_done else "wb"
+    output = open(args.output, mode)
+    output.truncate(state["output_bytes"])
+    output.seek(state["output_bytes"])
+
+    core_groups = cpu_tuning.split_cores(cpu_tuning.available_cores(), args.workers)
+    ctx = multiprocessing.get_context("spawn")
+    slot_counter = ctx.Value("i", 0)
+    pool = ctx.Pool(
+        processes=args.workers,
+        initializer=_init_worker,
+        initargs=(args.model, core_groups, slot_counter, args.batch_size)
+    )
+
+    # 限制在途分块数量，避免一次性把整个输入读进内存
+    max_in_flight = args.workers * 2
+    pending = deque()
+    start = time.time()
+    processed = 0
+    try:
+        chunks = iter_chunks(args.input, rows_done, args.chunk_rows)
+        for chunk in chunks:
+            pending.append((len(chunk), pool.apply_async(_score_chunk, (chunk,))))
+            while len(pending) >= max_in_flight:
+                processed += _write_next(pending, output, checkpoint_path, rows_done + processed, fingerprint)
+                _log_progress(rows_done + processed, processed, start)
+        while pending:
+            processed += _write_next(pending, output, checkpoint_path, rows_done + processed, fingerprint)
+            _log_progress(rows_done + processed, processed, start)
+    finally:
+        pool.terminate()
+        output.close()
+
+    logger.info(f"✅ 批量重排完成！本次处理 {processed} 行，耗时 {time.time() - start:.1f} 秒")
+    return processed
+
+
+def _write_next(pending: deque, output, checkpoint_path: str, rows_done: int, fingerprint: Dict) -> int:
+    """按提交顺序取回下一个分块的结果，写入输出并更新断点"""
+    num_rows, async_result = pending.popleft()
+    lines = async_result.get()
+    output.write(("\n".join(lines) + "\n").encode("utf-8"))
+    output.flush()
+    os.fsync(output.fileno())
+    save_checkpoint(checkpoint_path, rows_done + num_rows, output.tell(), fingerprint)
+    return num_rows
+
+
+def _log_progress(total_done: int, processed: int, start: float):
+    """输出处理进度"""
+    elapsed = max(time.time() - start, 1e-6)
+    logger.info(f"⏳ 已完成 {total_done} 行（{processed / elapsed:.1f} 行/秒）")
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="离线批量重排 JSONL 文件")
+    parser.add_argument("input", help="输入 JSONL 文件")
+    parser.add_argument("output", help="输出 JSONL 文件")
+    parser.add_argument("--model", default="BAAI/bge-reranker-large", help="模型名称")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="worker 进程数")
+    parser.add_argument("--batch-size", type=int, default=256, help="每次推理的 (query, document) 对数")
+    parser.add_argument("--chunk-rows", type=int, default=64, help="每个分块包含的输入行数")
+    parser.add_argument("--checkpoint", help="断点文件路径，默认为 <output>.ckpt")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print(f"❌ 输入文件不存在: {args.input}")
+        sys.exit(1)
+    try:
+        run(args)
+    except CheckpointMismatch as e:
+        print(f"❌ 无法从断点继续: {e}")
+        print(f"💡 如需重新开始，请删除断点文件: {args.checkpoint or args.output + '.ckpt'}")
+        sys.exit(1)
@@ -0,0 +1,356 @@
+"""
+CPU 线程与核心绑定配置
+控制 torch 的 intra-op / inter-op 线程数，并为每个 worker 进程分配独立的 CPU 核心，
+避免多个 uvicorn worker 同时使用全部核心导致的超额订阅（oversubscription）
+"""
+
+import logging
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持文件锁，退化为单槽位
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 环境变量配置（CLI 参数也会写入这些变量，以便 uvicorn 多 worker 继承）
+INTRA_OP_THREADS_ENV = "RERANK_INTRA_OP_THREADS"
+INTER_OP_THREADS_ENV = "RERANK_INTER_OP_THREADS"
+CPU_AFFINITY_ENV = "RERANK_CPU_AFFINITY"
+WORKERS_ENV = "RERANK_WORKERS"
+INSTANCE_ID_ENV = "RERANK_INSTANCE_ID"  # 区分同一主机上的多个服务实例，默认使用端口
+
+# worker 槽位锁文件，进程退出后锁自动释放，新 worker 可以复用该槽位
+_SLOT_LOCK_ROOT = os.path.join(tempfile.gettempdir(), "rerank-worker-slots")
+_slot_lock_file = None  # 保持文件句柄打开，直到进程退出
+
+# 当前进程生效的配置
+effective_settings: Dict = {}
+
+
+def available_cores() -> List[int]:
+    """返回当前进程允许使用的 CPU 核心列表"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_core_list(spec: str) -> List[int]:
+    """
+    解析核心列表，例如 "0-3,8,10-11"
+
+    Args:
+        spec: 核心列表字符串
+
+    Returns:
+        排序后的核心编号列表
+    """
+    cores = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cores.update(range(int(start), int(end) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def split_cores(cores: List[int], parts: int) -> List[List[int]]:
+    """把核心列表平均切分成 parts 份（连续切分，尽量保持在同一 NUMA 节点内）"""
+    parts = max(1, min(parts, len(cores)))
+    size, extra = divmod(len(cores), parts)
+    groups = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def claim_worker_slot(num_slots: int) -> int:
+    """
+    为当前进程抢占一个 worker 槽位
+
+    使用非阻塞的文件锁，进程退出（包括崩溃、被回收）时锁会自动释放。
+
+    Args:
+        num_slots: 槽位总数（一般等于 worker 数）
+
+    Returns:
+        槽位编号；所有槽位都被占用时返回 pid 取模的结果
+    """
+    global _slot_lock_file
+    if num_slots <= 1 or fcntl is None:
+        return 0
+
+    # 每个服务实例使用独立的槽位目录；未设置实例 ID 时用父进程（uvicorn 主进程）pid 区分
+    slot_dir = os.path.join(_SLOT_LOCK_ROOT, os.getenv(INSTANCE_ID_ENV) or f"ppid-{os.getppid()}")
+    os.makedirs(slot_dir, exist_ok=True)
+    for slot in range(num_slots):
+        lock_file = open(os.path.join(slot_dir, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _slot_lock_file = lock_file
+        return slot
+
+    logger.warning(f"⚠️  {num_slots} 个 worker 槽位均已占用，按 pid 分配")
+    return os.getpid() % num_slots
+
+
+def resolve_affinity(spec: str, num_workers: int, slot: int) -> Optional[List[int]]:
+    """
+    根据配置计算当前 worker 应绑定的核心
+
+    Args:
+        spec: 空字符串（不绑定）、"auto"（在 worker 间平分核心），
+              或用 ";" 分隔的每个 worker 的核心列表，例如 "0-3;4-7"
+        num_workers: worker 数
+        slot: 当前 worker 槽位
+
+    Returns:
+        核心列表；不绑定时返回 None
+    """
+    spec = spec.strip()
+    if not spec:
+        return None
+    if spec == "auto":
+        # worker 数多于可用核心时 split_cores 只会切出 len(cores) 组
+        groups = split_cores(available_cores(), num_workers)
+        return groups[slot % len(groups)]
+
+    groups = [g for g in spec.split(";") if g.strip()]
+    return parse_core_list(groups[slot % len(groups)])
+
+
+def apply_thread_settings(
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    cores: Optional[List[int]] = None
+) -> Dict:
+    """
+    设置当前进程的核心绑定与 torch 线程数
+
+    必须在模型执行任何推理之前调用（torch 的 inter-op 线程数只能设置一次）。
+
+    Args:
+        intra_op_threads: 算子内并行线程数，0 表示等于绑定的核心数；未绑定核心时保持 torch 默认值
+        inter_op_threads: 算子间并行线程数，0 表示保持 torch 默认值
+        cores: 绑定的核心列表，None 表示不绑定
+
+    Returns:
+        实际生效的配置
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    if intra_op_threads <= 0 and cores:
+        intra_op_threads = len(cores)
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+
+    if inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # inter-op 线程池已启动后无法再修改
+            logger.warning(f"⚠️  无法设置 inter-op 线程数: {e}")
+
+    return {
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads(),
+        "cpu_affinity": available_cores(),
+    }
+
+
+def configure_from_env() -> Dict:
+    """读取环境变量并应用到当前 worker 进程，返回生效的配置"""
+    global effective_settings
+    num_workers = int(os.getenv(WORKERS_ENV, "1") or 1)
+    affinity_spec = os.getenv(CPU_AFFINITY_ENV, "")
+
+    slot = claim_worker_slot(num_workers) if affinity_spec else 0
+    cores = resolve_affinity(affinity_spec, num_workers, slot)
+
+    # 未指定线程数也未绑定核心时：单 worker 保持 torch 默认值（物理核心数 / OMP_NUM_THREADS），
+    # 多 worker 在 worker 间平分核心，避免每个 worker 都使用全部核心造成超额订阅
+    intra_op_threads = int(os.getenv(INTRA_OP_THREADS_ENV, "0") or 0)
+    if intra_op_threads <= 0 and cores is None and num_workers > 1 and not os.getenv("OMP_NUM_THREADS"):
+        intra_op_threads = max(1, len(available_cores()) // num_workers)
+
+    settings = apply_thread_settings(
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=int(os.getenv(INTER_OP_THREADS_ENV, "0") or 0),
+        cores=cores
+    )
+    settings.update({
+        "pid": os.getpid(),
+        "worker_slot": slot,
+        "workers": num_workers,
+        "affinity_spec": affinity_spec or None,
+    })
+    effective_settings = settings
+
+    logger.info(
+        f"🧵 线程配置 - worker 槽位: {slot}/{num_workers}, "
+        f"intra-op: {settings['intra_op_threads']}, "
+        f"inter-op: {settings['inter_op_threads']}, "
+        f"绑定核心: {settings['cpu_affinity']}"
+    )
+    return settings
+
+
+# ============== 基准测试 ==============
+
+def _benchmark_worker(
+    load_model_fn: Callable,
+    model_name: str,
+    intra_op_threads: int,
+    inter_op_threads: int,
+    cores: List[int],
+    pairs: List[List[str]],
+    rounds: int,
+    barrier,
+    result_queue
+):
+    """在子进程中按指定线程配置加载模型并测量吞吐"""
+    try:
+        apply_thread_settings(intra_op_threads, inter_op_threads, cores)
+        model = load_model_fn(model_name)
+        model.predict(pairs[:8])  # 预热
+
+        barrier.wait()
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            model.predict(pairs)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+        result_queue.put({"pairs": len(pairs) * rounds, "elapsed": elapsed, "latencies": latencies})
+    except Exception as e:
+        result_queue.put({"error": str(e)})
+        barrier.abort()
+
+
+def _benchmark_pairs(num_docs: int) -> List[List[str]]:
+    """生成长度不一的合成测试数据"""
+    query = "什么是机器学习中的过拟合？"
+    base = "过拟合是指模型在训练数据上表现很好，但在新数据上表现差。"
+    return [[query, base * (1 + i % 8)] for i in range(num_docs)]
+
+
+def benchmark_thread_configs(
+    load_model_fn: Callable,
+    model_name: str,
+    num_docs: int = 64,
+    rounds: int = 5,
+    max_workers: Optional[int] = None
+) -> List[Dict]:
+    """
+    扫描 worker 数 × intra-op × inter-op 线程配置，测量整机吞吐
+
+    每个配置在独立的子进程中运行（inter-op 线程数只能在进程内设置一次），
+    多个 worker 同时运行并绑定到互不重叠的核心上，模拟真实部署。
+
+    Args:
+        load_model_fn: 模型加载函数（需可被 pickle，例如模块级函数）
+        model_name: 模型名称
+        num_docs: 每次 predict 的文档数
+        rounds: 每个 worker 的测量轮数
+        max_workers: 最大 worker 数，默认等于核心数
+
+    Returns:
+        按吞吐降序排列的测试结果
+    """
+    cores = available_cores()
+    max_workers = max_workers or len(cores)
+    pairs = _benchmark_pairs(num_docs)
+    ctx = multiprocessing.get_context("spawn")
+
+    worker_counts = []
+    w = 1
+    while w <= min(max_workers, len(cores)):
+        worker_counts.append(w)
+        w *= 2
+
+    results = []
+    for workers in worker_counts:
+        groups = split_cores(cores, workers)
+        threads = len(groups[0])
+        for inter_op in (1, 2):
+            if inter_op > threads:
+                continue
+            logger.info(f"⏱️  测试配置 - workers: {workers}, intra-op: {threads}, inter-op: {inter_op}")
+
+            barrier = ctx.Barrier(workers)
+            result_queue = ctx.Queue()
+            procs = [
+                ctx.Process(
+                    target=_benchmark_worker,
+                    args=(load_model_fn, model_name, threads, inter_op, group,
+                          pairs, rounds, barrier, result_queue)
+                )
+                for group in groups
+            ]
+            for p in procs:
+                p.start()
+            outputs = [result_queue.get() for _ in procs]
+            for p in procs:
+                p.join()
+
+            errors = [o["error"] for o in outputs if "error" in o]
+            if errors:
+                logger.error(f"❌ 配置测试失败: {errors[0]}")
+                continue
+
+            latencies = sorted(l for o in outputs for l in o["latencies"])
+            results.append({
+                "workers": workers,
+                "intra_op_threads": threads,
+                "inter_op_threads": inter_op,
+                "pairs_per_second": sum(o["pairs"] / o["elapsed"] for o in outputs),
+                "p50_latency_ms": statistics.median(latencies) * 1000,
+                "p95_latency_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+            })
+
+    results.sort(key=lambda r: r["pairs_per_second"], reverse=True)
+    return results
+
+
+def print_benchmark_report(results: List[Dict]):
+    """打印基准测试结果与推荐配置"""
+    print("=" * 72)
+    print(f"{'workers':>8} {'intra-op':>9} {'inter-op':>9} {'pairs/s':>10} {'p50(ms)':>10} {'p95(ms)':>10}")
+    print("-" * 72)
+    for r in results:
+        print(
+            f"{r['workers']:>8} {r['intra_op_threads']:>9} {r['inter_op_threads']:>9} "
+            f"{r['pairs_per_second']:>10.1f} {r['p50_latency_ms']:>10.1f} {r['p95_latency_ms']:>10.1f}"
+        )
+    print("=" * 72)
+
+    if not results:
+        print("❌ 没有可用的测试结果")
+        return
+
+    best = results[0]
+    print("\n🏆 推荐配置:")
+    print(f"export {WORKERS_ENV}={best['workers']}")
+    print(f"export {INTRA_OP_THREADS_ENV}={best['intra_op_threads']}")
+    print(f"export {INTER_OP_THREADS_ENV}={best['inter_op_threads']}")
+    print(f"export {CPU_AFFINITY_ENV}=auto")
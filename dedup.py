@@ -0,0 +1,87 @@
+"""
+在途去重
+同一请求内重复的文档只打分一次；并发请求中正在计算的相同 (query, document) 对
+只计算一次（single-flight），结果再分发回每个原始位置。
+只在计算期间共享结果，不做长期缓存
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Tuple
+
+
+class PairSingleFlight:
+    """按 (模型实例, query, document) 合并重复与并发的打分请求"""
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[int, str, str], Future] = {}
+        self._lock = threading.Lock()
+        self.requested_pairs = 0  # 请求中的文档总数
+        self.computed_pairs = 0   # 实际送入模型的文档数
+        self.joined_pairs = 0     # 复用其它请求正在计算的结果的文档数
+
+    def score(
+        self,
+        model,
+        query: str,
+        documents: List[str],
+        score_fn: Callable[..., List[float]]
+    ) -> List[float]:
+        """
+        计算分数，重复与并发的相同文档只计算一次
+
+        Args:
+            model: 模型实例
+            query: 查询文本
+            documents: 文档列表（可包含重复项）
+            score_fn: 实际打分函数 score_fn(model, query, documents) -> 分数列表
+
+        Returns:
+            与 documents 一一对应的分数列表
+        """
+        unique_docs = list(dict.fromkeys(documents))
+        owned: Dict[str, Future] = {}
+        joined: Dict[str, Future] = {}
+
+        with self._lock:
+            for doc in unique_docs:
+                key = (id(model), query, doc)
+                future = self._inflight.get(key)
+                if future is None:
+                    future = Future()
+                    self._inflight[key] = future
+                    owned[doc] = future
+                else:
+                    joined[doc] = future
+            self.requested_pairs += len(documents)
+            self.computed_pairs += len(owned)
+            self.joined_pairs += len(joined)
+
+        try:
+            if owned:
+                owned_docs = list(owned.keys())
+                for doc, score in zip(owned_docs, score_fn(model, query, owned_docs)):
+                    owned[doc].set_result(score)
+        except BaseException as e:
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for doc in owned:
+                    self._inflight.pop((id(model), query, doc), None)
+
+        scores = {doc: future.result() for doc, future in owned.items()}
+        scores.update({doc: future.result() for doc, future in joined.items()})
+        return [scores[doc] for doc in documents]
+
+    def stats(self) -> Dict:
+        """去重统计"""
+        return {
+            "requested_pairs": self.requested_pairs,
+            "computed_pairs": self.computed_pairs,
+            "joined_pairs": self.joined_pairs,
+            "deduplicated_pairs": self.requested_pairs - self.computed_pairs - self.joined_pairs,
+            "inflight_pairs": len(self._inflight),
+        }
@@ -0,0 +1,265 @@
+"""
+服务端文档存储
+批量注册的文档持久化在本地磁盘：文本与预先分词的 token id 追加写入二进制文件并通过 mmap 读取，
+索引保存在 sqlite 中。请求可以只传文档 id，服务端直接使用存储的 token id 打分，跳过文档分词；
+也可以保存 late-interaction 模式使用的文档 token 向量（按行量化为 int8）
+"""
+
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持文件锁，只能单进程写入
+    fcntl = None
+
+TOKEN_DTYPE = np.int32
+VECTOR_DTYPE = np.int8  # token 向量按行对称量化，每行另存一个 float32 缩放系数
+SCALE_DTYPE = np.float32
+
+
+def quantize_vectors(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按行把 token 向量量化为 int8
+
+    Args:
+        matrix: [token 数, 维度] 浮点矩阵
+
+    Returns:
+        (int8 矩阵, 每行的缩放系数)，原向量约等于 int8 矩阵 × 缩放系数
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127 if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+    scales = np.where(scales > 0, scales, 1).astype(SCALE_DTYPE)
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(VECTOR_DTYPE)
+    return quantized, scales
+
+
+def dequantize_vectors(quantized: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """把 int8 token 向量还原为 float32"""
+    return quantized.astype(np.float32) * scales[:, None]
+
+
+class _AppendOnlyBlob:
+    """
+    只追加写入的二进制文件，读取时通过 mmap 访问（文件增长后自动重新映射）
+
+    多个 worker 进程可能同时追加同一文件：写入使用无缓冲的 os.write（O_APPEND），
+    并在文件锁内写入后用 fstat 取得文件末尾，从而得到本次写入的真实位置。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def append(self, data: bytes) -> int:
+        """追加数据，返回写入位置"""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(self._fd, view)
+                    view = view[written:]
+                end = os.fstat(self._fd).st_size
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            return end - len(data)
+
+    def flush(self):
+        with self._lock:
+            os.fsync(self._fd)
+
+    def read(self, offset: int, length: int) -> memoryview:
+        """读取一段数据（零拷贝）"""
+        if length == 0:
+            return memoryview(b"")
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                # 旧映射可能仍被返回的 memoryview 引用，不主动关闭，由引用计数回收
+                self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+            return memoryview(self._map)[offset:offset + length]
+
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+
+class DocumentStore:
+    """
+    基于磁盘的文档存储
+
+    目录结构：
+        index.sqlite          文档 id -> 文本 / token 在二进制文件中的位置
+        texts.bin             UTF-8 文本
+        tokens-<key>.bin      按 tokenizer 分别存储的 int32 token id（不含特殊 token）
+        qvectors-<key>.bin    按向量编码器分别存储的 token 向量：每个文档一个 [token 数, 维度] 的 int8 矩阵，
+                              后接每行的 float32 缩放系数（1024 维时每个 token 约 1KB）
+
+    同一 id 重复注册时追加新内容并更新索引，旧内容占用的空间不回收。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id TEXT PRIMARY KEY, text_offset INTEGER, text_length INTEGER, updated_at REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "doc_id TEXT, tokenizer TEXT, token_offset INTEGER, token_count INTEGER, "
+            "PRIMARY KEY (doc_id, tokenizer))"
+        )
+        # 早期版本的 float16 向量保存在 vectors 表中，格式不同，不再读取
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS quantized_vectors ("
+            "doc_id TEXT, encoder TEXT, vector_offset INTEGER, vector_count INTEGER, dim INTEGER, "
+            "PRIMARY KEY (doc_id, encoder))"
+        )
+        self._db.commit()
+        self._texts = _AppendOnlyBlob(os.path.join(directory, "texts.bin"))
+        self._token_blobs: Dict[str, _AppendOnlyBlob] = {}
+        self._vector_blobs: Dict[str, _AppendOnlyBlob] = {}
+        self._lock = threading.Lock()
+
+    def _token_blob(self, key: str) -> _AppendOnlyBlob:
+        if key not in self._token_blobs:
+            self._token_blobs[key] = _AppendOnlyBlob(os.path.join(self.directory, f"tokens-{key}.bin"))
+        return self._token_blobs[key]
+
+    def _vector_blob(self, key: str) -> _AppendOnlyBlob:
+        if key not in self._vector_blobs:
+            self._vector_blobs[key] = _AppendOnlyBlob(os.path.join(self.directory, f"qvectors-{key}.bin"))
+        return self._vector_blobs[key]
+
+    def put_many(
+        self,
+        documents: List[Tuple[str, str]],
+        tokenizers: Optional[Dict[str, Callable[[List[str]], List[List[int]]]]] = None,
+        encoders: Optional[Dict[str, Callable[[List[str]], List[np.ndarray]]]] = None
+    ) -> int:
+        """
+        批量注册文档
+
+        Args:
+            documents: (id, text) 列表
+            tokenizers: {tokenizer key: 批量分词函数}，注册时预先分词并保存
+            encoders: {编码器 key: 批量编码函数，返回每个文本的 [token 数, 维度] 向量}，注册时预先计算并保存
+
+        Returns:
+            注册的文档数
+        """
+        texts = [text for _, text in documents]
+        token_lists = {key: fn(texts) for key, fn in (tokenizers or {}).items()}
+        vector_lists = {key: fn(texts) for key, fn in (encoders or {}).items()}
+
+        with self._lock:
+            now = time.time()
+            doc_rows, token_rows, vector_rows = [], [], []
+            for i, (doc_id, text) in enumerate(documents):
+                data = text.encode("utf-8")
+                doc_rows.append((doc_id, self._texts.append(data), len(data), now))
+                for key, ids in token_lists.items():
+                    array = np.asarray(ids[i], dtype=TOKEN_DTYPE)
+                    offset = self._token_blob(key).append(array.tobytes())
+                    token_rows.append((doc_id, key, offset, len(array)))
+                for key, vectors in vector_lists.items():
+                    quantized, scales = quantize_vectors(vectors[i])
+                    offset = self._vector_blob(key).append(quantized.tobytes() + scales.tobytes())
+                    vector_rows.append((doc_id, key, offset, quantized.shape[0], quantized.shape[1]))
+
+            # 数据先落盘，再提交索引，保证索引指向的内容一定完整
+            self._texts.flush()
+            for key in token_lists:
+                self._token_blob(key).flush()
+            for key in vector_lists:
+                self._vector_blob(key).flush()
+            self._db.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)", doc_rows)
+            # 文本更新后，其它 tokenizer / 编码器下的旧结果失效
+            for table in ("tokens", "quantized_vectors"):
+                self._db.executemany(
+                    f"DELETE FROM {table} WHERE doc_id = ?",
+                    [(doc_id,) for doc_id, _ in documents]
+                )
+            self._db.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)", token_rows)
+            self._db.executemany("INSERT OR REPLACE INTO quantized_vectors VALUES (?, ?, ?, ?, ?)", vector_rows)
+            self._db.commit()
+        return len(documents)
+
+    def _query_many(self, sql: str, ids: List[str], extra: tuple = ()) -> Dict[str, tuple]:
+        """按 id 批量查询索引（分批避免超出 sqlite 参数上限）"""
+        rows = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self._lock:
+            for start in range(0, len(unique_ids), 500):
+                batch = unique_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for row in self._db.execute(sql.format(placeholders), extra + tuple(batch)):
+                    rows[row[0]] = row[1:]
+        return rows
+
+    def get_texts(self, ids: List[str]) -> List[Optional[str]]:
+        """读取文档文本，不存在的 id 返回 None"""
+        rows = self._query_many(
+            "SELECT id, text_offset, text_length FROM documents WHERE id IN ({})", ids
+        )
+        return [
+            str(self._texts.read(*rows[doc_id]), "utf-8") if doc_id in rows else None
+            for doc_id in ids
+        ]
+
+    def get_tokens(self, ids: List[str], key: str) -> Dict[str, np.ndarray]:
+        """读取预先分词的 token id（mmap 零拷贝），没有该 tokenizer 分词结果的 id 不在返回值中"""
+        rows = self._query_many(
+            "SELECT doc_id, token_offset, token_count FROM tokens WHERE tokenizer = ? AND doc_id IN ({})",
+            ids,
+            extra=(key,)
+        )
+        blob = self._token_blob(key)
+        itemsize = np.dtype(TOKEN_DTYPE).itemsize
+        return {
+            doc_id: np.frombuffer(blob.read(offset, count * itemsize), dtype=TOKEN_DTYPE)
+            for doc_id, (offset, count) in rows.items()
+        }
+
+    def get_vectors(self, ids: List[str], key: str) -> Dict[str, np.ndarray]:
+        """读取预先计算的 token 向量（还原为 float32 的 [token 数, 维度]），没有该编码器向量的 id 不在返回值中"""
+        rows = self._query_many(
+            "SELECT doc_id, vector_offset, vector_count, dim FROM quantized_vectors "
+            "WHERE encoder = ? AND doc_id IN ({})",
+            ids,
+            extra=(key,)
+        )
+        blob = self._vector_blob(key)
+        vectors = {}
+        for doc_id, (offset, count, dim) in rows.items():
+            data = blob.read(offset, count * dim + count * np.dtype(SCALE_DTYPE).itemsize)
+            quantized = np.frombuffer(data[:count * dim], dtype=VECTOR_DTYPE).reshape(count, dim)
+            scales = np.frombuffer(data[count * dim:], dtype=SCALE_DTYPE)
+            vectors[doc_id] = dequantize_vectors(quantized, scales)
+        return vectors
+
+    def stats(self) -> Dict:
+        """存储统计"""
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            tokenizers = [row[0] for row in self._db.execute("SELECT DISTINCT tokenizer FROM tokens")]
+            encoders = [row[0] for row in self._db.execute("SELECT DISTINCT encoder FROM quantized_vectors")]
+        return {
+            "directory": self.directory,
+            "documents": count,
+            "tokenizers": tokenizers,
+            "vector_encoders": encoders,
+            "text_bytes": self._texts.size(),
+        }
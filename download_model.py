@@ -1,11 +1,294 @@
 """
 下载 Rerank 模型到本地目录
 支持多种模型选择和断点续传
+
+交互式使用:
+    python download_model.py
+
+非交互式（节点初始化 / 自动扩容脚本）:
+    python download_model.py --model BAAI/bge-reranker-base --model BAAI/bge-reranker-large --jobs 8
+    python download_model.py --all --mirror https://hf-mirror.com
+    python download_model.py --all --artifact-dir /mnt/artifacts/models
 """
 
+import argparse
+import hashlib
+import json
 import os
+import shutil
 import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Optional
+
+# 模型选项
+MODELS = {
+    "1": {
+        "name": "BAAI/bge-reranker-large",
+        "dir": "models/bge-reranker-large",
+        "desc": "BGE Reranker Large（推荐，高精度，约 1.1GB）"
+    },
+    "2": {
+        "name": "BAAI/bge-reranker-base",
+        "dir": "models/bge-reranker-base",
+        "desc": "BGE Reranker Base（快速，约 400MB）"
+    },
+    "3": {
+        "name": "BAAI/bge-reranker-v2-m3",
+        "dir": "models/bge-reranker-v2-m3",
+        "desc": "BGE Reranker v2 M3（多语言，约 560MB）"
+    },
+    "4": {
+        "name": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        "dir": "models/ms-marco-minilm",
+        "desc": "MS MARCO MiniLM（英文优化，约 80MB）"
+    },
+    "5": {
+        "name": "BAAI/bge-m3",
+        "dir": "models/bge-m3",
+        "desc": "BGE M3（bge-reranker-v2-m3 的 late-interaction 打分模式使用，约 2.2GB）"
+    }
+}
+
+
+# 服务加载所需的文件；权重优先使用可内存映射的 safetensors 格式
+_REQUIRED_SUFFIXES = (".json", ".txt", ".model", ".safetensors")
+_FALLBACK_WEIGHTS = "pytorch_model.bin"
+_EXTRA_FILES = ("colbert_linear.pt",)  # BGE-M3 的多向量投影层
+_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _default_endpoint() -> str:
+    """默认下载地址（支持通过 HF_ENDPOINT 配置镜像站）"""
+    return os.getenv("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+
+
+def _http_get_json(url: str, timeout: int = 30):
+    """GET 请求并解析 JSON 响应"""
+    request = urllib.request.Request(url, headers=_auth_headers())
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def _auth_headers() -> Dict[str, str]:
+    """私有模型或镜像需要的认证头（读取 HF_TOKEN）"""
+    token = os.getenv("HF_TOKEN")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def select_files(files: List[Dict]) -> List[Dict]:
+    """
+    只保留服务加载需要的文件
+
+    跳过 onnx 等其它格式；仓库中存在 safetensors 权重时不再下载 pytorch_model.bin。
+    """
+    top_level = [f for f in files if "/" not in f["name"]]
+    has_safetensors = any(f["name"].endswith(".safetensors") for f in top_level)
+    selected = [f for f in top_level if f["name"].endswith(_REQUIRED_SUFFIXES) or f["name"] in _EXTRA_FILES]
+    if not has_safetensors:
+        selected += [f for f in top_level if f["name"] == _FALLBACK_WEIGHTS]
+    return selected
+
+
+def list_remote_files(model_name: str, endpoint: str, revision: str) -> List[Dict]:
+    """
+    从 Hugging Face（或兼容的镜像站）获取模型文件清单
+
+    Returns:
+        [{"name", "size", "sha256"（LFS 文件）, "git_sha1"（普通文件）}]
+    """
+    url = f"{endpoint}/api/models/{model_name}/revision/{urllib.parse.quote(revision, safe='')}?blobs=true"
+    info = _http_get_json(url)
+    files = []
+    for sibling in info.get("siblings", []):
+        lfs = sibling.get("lfs") or {}
+        files.append({
+            "name": sibling["rfilename"],
+            "size": lfs.get("size", sibling.get("size")),
+            "sha256": lfs.get("sha256"),
+            "git_sha1": None if lfs else sibling.get("blobId"),
+        })
+    return select_files(files)
+
+
+def list_artifact_files(artifact_dir: str) -> List[Dict]:
+    """
+    读取本地制品目录中的文件清单
+
+    目录中存在 SHA256SUMS（sha256sum 输出格式）时用于校验。
+    """
+    checksums = {}
+    sums_path = os.path.join(artifact_dir, "SHA256SUMS")
+    if os.path.exists(sums_path):
+        with open(sums_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    digest, name = line.split(None, 1)
+                    checksums[name.strip().lstrip("*")] = digest
+    files = [
+        {
+            "name": name,
+            "size": os.path.getsize(os.path.join(artifact_dir, name)),
+            "sha256": checksums.get(name),
+            "git_sha1": None,
+        }
+        for name in sorted(os.listdir(artifact_dir))
+        if os.path.isfile(os.path.join(artifact_dir, name))
+    ]
+    return select_files(files)
+
+
+def verify_file(path: str, expected: Dict) -> bool:
+    """按大小与 sha256（LFS）或 git blob sha1（普通文件）校验文件"""
+    size = os.path.getsize(path)
+    if expected.get("size") is not None and size != expected["size"]:
+        return False
+    if expected.get("sha256"):
+        digest = hashlib.sha256()
+    elif expected.get("git_sha1"):
+        digest = hashlib.sha1(f"blob {size}\0".encode("utf-8"))
+    else:
+        return True
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest() == (expected.get("sha256") or expected.get("git_sha1"))
+
+
+def fetch_remote_file(url: str, target: str, expected: Dict, retries: int = 3) -> int:
+    """
+    下载单个文件，支持按字节范围断点续传
+
+    数据先写入 <target>.part，校验通过后再原子重命名为目标文件。
+
+    Returns:
+        本次实际传输的字节数
+    """
+    part_path = target + ".part"
+    for attempt in range(1, retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = dict(_auth_headers())
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        transferred = 0
+        try:
+            request = urllib.request.Request(url, headers=headers)
+            with urllib.request.urlopen(request, timeout=60) as response:
+                # 服务端不支持 Range 时从头开始
+                mode = "ab" if offset and response.status == 206 else "wb"
+                with open(part_path, mode) as f:
+                    for chunk in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        transferred += len(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:  # 请求范围无效：.part 已完整或已损坏，交给校验处理
+                pass
+            elif attempt == retries:
+                raise
+            else:
+                continue
+        except OSError:
+            if attempt == retries:
+                raise
+            continue
+
+        if verify_file(part_path, expected):
+            os.replace(part_path, target)
+            return transferred
+        os.remove(part_path)  # 校验失败，下一次重新下载
+
+    raise RuntimeError(f"文件校验失败: {os.path.basename(target)}")
+
+
+def copy_artifact_file(source: str, target: str, expected: Dict) -> int:
+    """从本地制品目录复制文件（同一文件系统时使用硬链接，避免复制数据）"""
+    if not verify_file(source, expected):
+        raise RuntimeError(f"制品文件校验失败: {source}")
+    tmp_path = target + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+    return expected.get("size") or 0
+
+
+def provision_model(
+    model_name: str,
+    save_dir: str,
+    endpoint: Optional[str] = None,
+    artifact_dir: Optional[str] = None,
+    revision: str = "main",
+    jobs: int = 4
+) -> bool:
+    """
+    非交互式地准备模型文件
+
+    并行下载所需文件，已存在且校验通过的文件直接跳过，未完成的文件按字节范围续传。
+    文件直接写入服务端加载的目录结构（safetensors 权重可被内存映射加载），
+    不经过 CrossEncoder 加载再保存。
+
+    Args:
+        model_name: Hugging Face 模型名称
+        save_dir: 保存目录
+        endpoint: Hugging Face 兼容的镜像地址，默认读取 HF_ENDPOINT
+        artifact_dir: 本地制品根目录（其下 <模型目录名>/ 中存放模型文件），优先于网络下载
+        revision: 模型版本（分支、tag 或 commit）
+        jobs: 并行下载的文件数
+
+    Returns:
+        是否成功
+    """
+    endpoint = (endpoint or _default_endpoint()).rstrip("/")
+    os.makedirs(save_dir, exist_ok=True)
+
+    source_dir = os.path.join(artifact_dir, os.path.basename(save_dir.rstrip("/"))) if artifact_dir else None
+    try:
+        if source_dir and os.path.isdir(source_dir):
+            print(f"📦 [{model_name}] 使用本地制品: {source_dir}")
+            files = list_artifact_files(source_dir)
+        else:
+            print(f"📦 [{model_name}] 从 {endpoint} 获取文件清单 (revision: {revision})")
+            files = list_remote_files(model_name, endpoint, revision)
+    except Exception as e:
+        print(f"❌ [{model_name}] 获取文件清单失败: {e}")
+        return False
+
+    def provision_file(f: Dict) -> int:
+        target = os.path.join(save_dir, f["name"])
+        if os.path.exists(target) and verify_file(target, f):
+            return 0
+        if source_dir and os.path.isdir(source_dir):
+            return copy_artifact_file(os.path.join(source_dir, f["name"]), target, f)
+        url = f"{endpoint}/{model_name}/resolve/{urllib.parse.quote(revision, safe='')}/{f['name']}"
+        return fetch_remote_file(url, target, f)
+
+    transferred = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {executor.submit(provision_file, f): f["name"] for f in files}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                size = future.result()
+                transferred += size
+                print(f"   ✅ {name}" + (f" ({size / 1024 / 1024:.1f} MB)" if size else "（已存在，校验通过）"))
+            except Exception as e:
+                failures.append(name)
+                print(f"   ❌ {name}: {e}")
+
+    if failures:
+        print(f"❌ [{model_name}] {len(failures)} 个文件失败，重新运行即可续传")
+        return False
+
+    print(f"🎉 [{model_name}] 完成，{len(files)} 个文件，本次传输 {transferred / 1024 / 1024:.1f} MB")
+    return True
+
 
 def download_model(model_name: str, save_dir: str):
     """
@@ -16,20 +299,12 @@ def download_model(model_name: str, save_dir: str):
         save_dir: 保存目录
     """
     try:
-        from sentence_transformers import CrossEncoder
-        
         print(f"📦 开始下载模型: {model_name}")
         print(f"💾 保存路径: {save_dir}")
         print("⏳ 请稍候，这可能需要几分钟...\n")
         
-        # 创建目录
-        os.makedirs(save_dir, exist_ok=True)
-        
-        # 下载模型
-        model = CrossEncoder(model_name, max_length=512)
-        
-        # 保存到本地
-        model.save(save_dir)
+        if not provision_model(model_name, save_dir):
+            raise RuntimeError("部分文件下载失败")
         
         print(f"\n✅ 模型下载完成！")
         print(f"📂 模型文件位置: {os.path.abspath(save_dir)}")
@@ -60,44 +335,20 @@ def main():
     print("🤖 Rerank 模型下载工具")
     print("="*60 + "\n")
     
-    # 模型选项
-    models = {
-        "1": {
-            "name": "BAAI/bge-reranker-large",
-            "dir": "models/bge-reranker-large",
-            "desc": "BGE Reranker Large（推荐，高精度，约 1.1GB）"
-        },
-        "2": {
-            "name": "BAAI/bge-reranker-base",
-            "dir": "models/bge-reranker-base",
-            "desc": "BGE Reranker Base（快速，约 400MB）"
-        },
-        "3": {
-            "name": "BAAI/bge-reranker-v2-m3",
-            "dir": "models/bge-reranker-v2-m3",
-            "desc": "BGE Reranker v2 M3（多语言，约 560MB）"
-        },
-        "4": {
-            "name": "cross-encoder/ms-marco-MiniLM-L-6-v2",
-            "dir": "models/ms-marco-minilm",
-            "desc": "MS MARCO MiniLM（英文优化，约 80MB）"
-        }
-    }
-    
     print("请选择要下载的模型：\n")
-    for key, info in models.items():
+    for key, info in MODELS.items():
         print(f"{key}. {info['desc']}")
         print(f"   模型: {info['name']}")
         print(f"   路径: {info['dir']}\n")
     
     # 获取用户选择
-    choice = input("请输入选项 (1-4) [默认: 1]: ").strip() or "1"
+    choice = input("请输入选项 (1-5) [默认: 1]: ").strip() or "1"
     
-    if choice not in models:
+    if choice not in MODELS:
         print("❌ 无效选项！")
         return
     
-    selected = models[choice]
+    selected = MODELS[choice]
     
     # 检查目录是否已存在
     if os.path.exists(selected['dir']):
@@ -117,13 +368,55 @@ def main():
         print("\npython rerank_server.py\n")
 
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Rerank 模型下载工具（不带参数时进入交互模式）")
+    parser.add_argument("--model", action="append", default=[], help="要下载的模型名称，可重复指定")
+    parser.add_argument("--all", action="store_true", help="下载所有内置模型")
+    parser.add_argument("--dir", help="保存目录（仅下载单个模型时有效，默认使用内置路径）")
+    parser.add_argument("--mirror", help="Hugging Face 兼容的镜像地址，默认读取 HF_ENDPOINT")
+    parser.add_argument("--artifact-dir", help="本地制品根目录，存在对应模型目录时直接从这里复制")
+    parser.add_argument("--revision", default="main", help="模型版本（分支、tag 或 commit）")
+    parser.add_argument("--jobs", type=int, default=4, help="并行下载的文件数")
+    return parser.parse_args()
+
+
+def provision_from_args(args) -> bool:
+    """非交互模式：按命令行参数准备模型"""
+    known = {info["name"]: info["dir"] for info in MODELS.values()}
+    names = list(known) if args.all else args.model
+    
+    failed = []
+    for name in names:
+        if args.dir and len(names) == 1:
+            save_dir = args.dir
+        else:
+            save_dir = known.get(name, os.path.join("models", name.split("/")[-1]))
+        # 单个模型失败不影响其它模型，最终以非零状态退出
+        try:
+            ok = provision_model(
+                name,
+                save_dir,
+                endpoint=args.mirror,
+                artifact_dir=args.artifact_dir,
+                revision=args.revision,
+                jobs=args.jobs
+            )
+        except Exception as e:
+            print(f"❌ [{name}] 准备失败: {e}")
+            ok = False
+        if not ok:
+            failed.append(name)
+    
+    if failed:
+        print(f"\n❌ {len(failed)} 个模型未完成: {', '.join(failed)}")
+    return not failed
+
+
 if __name__ == "__main__":
-    # 检查依赖
-    try:
-        import sentence_transformers
-    except ImportError:
-        print("❌ 缺少依赖包！请先安装：")
-        print("pip install sentence-transformers")
-        sys.exit(1)
+    args = parse_args()
+    
+    if args.model or args.all:
+        sys.exit(0 if provision_from_args(args) else 1)
     
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,119 @@
+"""
+Late-interaction（多向量）打分
+query 与文档分别编码为 token 向量，分数为 query 每个 token 与文档所有 token 的最大相似度的平均（MaxSim）。
+文档向量可以预先计算并保存在文档存储中，请求时只需编码 query，不必对每个 (query, document) 对运行整个 transformer
+"""
+
+import logging
+import os
+from typing import List
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+COLBERT_WEIGHTS = "colbert_linear.pt"
+
+
+class LateInteractionEncoder:
+    """
+    token 向量编码器（BGE-M3 的 multi-vector / ColBERT 输出）
+
+    bge-reranker-v2-m3 由 BGE-M3 初始化，两者共享 XLM-RoBERTa 骨干与 tokenizer；
+    cross-encoder 本身没有可独立编码文档的输出，因此该系列的 late-interaction 模式使用 BGE-M3 的多向量输出：
+    最后一层隐状态（去掉 [CLS]）经过 colbert_linear 投影后做 L2 归一化。
+    """
+
+    def __init__(self, model_path: str, max_length: int = 512, batch_size: int = 16):
+        """
+        Args:
+            model_path: 本地目录或 Hugging Face 模型名
+            max_length: 最大 token 数
+            batch_size: 编码批大小
+        """
+        self.model_path = model_path
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModel.from_pretrained(model_path).eval()
+        hidden_size = self.model.config.hidden_size
+        self.colbert_linear = torch.nn.Linear(hidden_size, hidden_size)
+        weights = self._colbert_weights_path()
+        if weights is not None:
+            self.colbert_linear.load_state_dict(torch.load(weights, map_location="cpu"))
+        else:
+            logger.warning(f"⚠️  {model_path} 中没有 {COLBERT_WEIGHTS}，直接使用最后一层隐状态作为 token 向量")
+            self.colbert_linear = torch.nn.Identity()
+        self.colbert_linear.eval()
+        self.dim = hidden_size
+
+    def _colbert_weights_path(self):
+        """查找多向量投影层权重（本地目录优先，其次 Hugging Face 缓存）"""
+        if os.path.isdir(self.model_path):
+            path = os.path.join(self.model_path, COLBERT_WEIGHTS)
+            return path if os.path.exists(path) else None
+        try:
+            from huggingface_hub import hf_hub_download
+            return hf_hub_download(self.model_path, COLBERT_WEIGHTS)
+        except Exception:
+            return None
+
+    def encode(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        编码文本为 token 向量
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            每个文本一个 [token 数, 维度] 的 float32 矩阵（已 L2 归一化）
+        """
+        outputs: List[np.ndarray] = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                features = self.tokenizer(
+                    [texts[i] for i in batch],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt"
+                )
+                hidden = self.model(**features, return_dict=True).last_hidden_state
+                vectors = torch.nn.functional.normalize(self.colbert_linear(hidden[:, 1:]), dim=-1)
+                lengths = features["attention_mask"][:, 1:].sum(dim=1).tolist()
+                vectors = vectors.float().numpy()
+                for row, i in enumerate(batch):
+                    outputs[i] = vectors[row, :lengths[row]]
+        return outputs
+
+
+def maxsim_scores(query_vectors: np.ndarray, doc_vectors: List[np.ndarray]) -> List[float]:
+    """
+    向量化计算 MaxSim：所有文档的 token 向量拼接后与 query 做一次矩阵乘，再按文档分段取最大值
+
+    Args:
+        query_vectors: [query token 数, 维度]
+        doc_vectors: 每个文档的 [token 数, 维度]
+
+    Returns:
+        每个文档的分数（query 各 token 最大相似度的平均）
+    """
+    if not doc_vectors:
+        return []
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+    counts = np.array([len(v) for v in doc_vectors])
+    non_empty = np.flatnonzero(counts)
+    scores = np.zeros(len(doc_vectors), dtype=np.float32)
+    if len(non_empty) == 0 or len(query_vectors) == 0:
+        return scores.tolist()
+
+    stacked = np.concatenate([doc_vectors[i] for i in non_empty]).astype(np.float32, copy=False)
+    similarity = query_vectors @ stacked.T  # [query token 数, 所有文档 token 数]
+    starts = np.concatenate([[0], np.cumsum(counts[non_empty])[:-1]])
+    per_doc_max = np.maximum.reduceat(similarity, starts, axis=1)  # [query token 数, 文档数]
+    scores[non_empty] = per_doc_max.mean(axis=0)
+    return scores.tolist()
@@ -0,0 +1,186 @@
+"""
+内存看门狗
+统计进程与各模型的内存占用，定期回收 Python 与 glibc 分配器的空闲内存；
+RSS 超过上限时让 worker 优雅退出（停止接收新连接、处理完在途请求），由进程管理器拉起新的 worker
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import signal
+import time
+from typing import Callable, Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+_libc = None
+
+
+def _load_libc():
+    """加载 glibc（用于 malloc_trim），非 glibc 平台返回 None"""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+            _libc.malloc_trim  # 非 glibc（如 musl、macOS）没有该函数
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+
+def process_rss_bytes() -> int:
+    """当前进程的常驻内存（RSS）"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    # 非 Linux 平台退化为峰值 RSS（macOS 单位为字节，其它为 KB）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def model_memory_bytes(model) -> int:
+    """模型权重与缓冲区占用的内存"""
+    module = getattr(model, "model", model)
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def trim_allocators() -> Dict:
+    """
+    回收空闲内存：Python 垃圾回收 + glibc malloc_trim（+ CUDA 缓存）
+
+    Returns:
+        回收前后的 RSS
+    """
+    before = process_rss_bytes()
+    gc.collect()
+    libc = _load_libc()
+    if libc is not None:
+        libc.malloc_trim(0)
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    after = process_rss_bytes()
+    return {"rss_before_bytes": before, "rss_after_bytes": after}
+
+
+class MemoryWatchdog:
+    """
+    周期性检查进程内存
+
+    - 每隔 trim_interval 秒回收一次空闲内存
+    - RSS 超过 max_rss_bytes 时先回收一次，仍超过则向自身发送 SIGTERM：
+      uvicorn 会停止接收新连接、等待在途请求完成后退出，
+      多 worker 模式下由进程管理器（uvicorn / gunicorn / systemd / k8s）拉起新的 worker
+    - recycle=False（单进程且没有外部进程管理器）时退出会导致整个服务停止，只记录告警、不退出
+    """
+
+    def __init__(
+        self,
+        max_rss_bytes: int = 0,
+        check_interval: float = 30.0,
+        trim_interval: float = 300.0,
+        models_fn: Optional[Callable[[], Dict]] = None,
+        recycle: bool = True
+    ):
+        """
+        Args:
+            max_rss_bytes: RSS 上限，0 表示不限制
+            check_interval: 检查间隔（秒）
+            trim_interval: 定期回收间隔（秒），0 表示不定期回收
+            models_fn: 返回当前已加载模型 {name: model} 的函数，用于统计各模型内存
+            recycle: 超过上限时是否退出进程（需要有进程管理器拉起新的进程）
+        """
+        self.max_rss_bytes = max_rss_bytes
+        self.check_interval = check_interval
+        self.trim_interval = trim_interval
+        self.models_fn = models_fn or (lambda: {})
+        self.recycle = recycle
+        self.state = "running"
+        self.trims = 0
+        self.last_trim: Optional[Dict] = None
+        self._last_trim_at = time.monotonic()
+        self._task = None
+
+    def start(self):
+        """在当前事件循环中启动后台检查任务"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        """后台循环：检查放到线程池中执行，避免 gc 暂停阻塞事件循环"""
+        loop = asyncio.get_event_loop()
+        while self.state == "running":
+            await asyncio.sleep(self.check_interval)
+            try:
+                await loop.run_in_executor(None, self.check)
+            except Exception as e:
+                logger.error(f"❌ 内存检查失败: {str(e)}")
+
+    def trim(self) -> Dict:
+        """执行一次回收并记录结果"""
+        result = trim_allocators()
+        self.trims += 1
+        self.last_trim = result
+        self._last_trim_at = time.monotonic()
+        freed = (result["rss_before_bytes"] - result["rss_after_bytes"]) / 1024 / 1024
+        logger.info(f"🧹 内存回收完成，释放 {freed:.1f} MB，当前 RSS {result['rss_after_bytes'] / 1024 / 1024:.1f} MB")
+        return result
+
+    def check(self):
+        """检查一次内存，必要时回收或回收 worker"""
+        if self.trim_interval > 0 and time.monotonic() - self._last_trim_at >= self.trim_interval:
+            self.trim()
+
+        if self.max_rss_bytes <= 0 or process_rss_bytes() <= self.max_rss_bytes:
+            if self.state == "over_limit":
+                self.state = "running"
+            return
+
+        rss = self.trim()["rss_after_bytes"]
+        if rss <= self.max_rss_bytes:
+            if self.state == "over_limit":
+                self.state = "running"
+            return
+
+        if not self.recycle:
+            if self.state != "over_limit":
+                logger.error(
+                    f"🚨 RSS {rss / 1024 / 1024:.1f} MB 超过上限 {self.max_rss_bytes / 1024 / 1024:.1f} MB，"
+                    f"但当前为单进程部署、没有进程管理器替换，不回收 worker"
+                )
+            self.state = "over_limit"
+            return
+
+        self.state = "recycling"
+        logger.warning(
+            f"♻️  RSS {rss / 1024 / 1024:.1f} MB 超过上限 {self.max_rss_bytes / 1024 / 1024:.1f} MB，"
+            f"worker {os.getpid()} 停止接收新请求，处理完在途请求后退出"
+        )
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def stats(self) -> Dict:
+        """当前内存统计"""
+        models = {}
+        for name, model in self.models_fn().items():
+            models[name] = {"weights_mb": round(model_memory_bytes(model) / 1024 / 1024, 1)}
+        return {
+            "state": self.state,
+            "pid": os.getpid(),
+            "rss_mb": round(process_rss_bytes() / 1024 / 1024, 1),
+            "max_rss_mb": round(self.max_rss_bytes / 1024 / 1024, 1) if self.max_rss_bytes else None,
+            "recycle": self.recycle,
+            "models": models,
+            "trims": self.trims,
+            "last_trim": self.last_trim,
+        }
@@ -0,0 +1,277 @@
+"""
+模型执行优化
+为 CrossEncoder 提供降精度（bf16/fp16）与图优化（torch.compile / TorchScript）执行模式，
+并提供与 fp32 基线对比排序一致性的精度校验
+"""
+
+import inspect
+import json
+import logging
+from typing import Dict, List, Optional
+
+import torch
+from transformers.modeling_outputs import SequenceClassifierOutput
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_DTYPES = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
+# CPU 原生支持对应精度计算的指令集标志（/proc/cpuinfo）
+_NATIVE_CPU_FLAGS = {
+    "bfloat16": ("avx512_bf16", "amx_bf16"),
+    "float16": ("avx512_fp16", "amx_fp16"),
+}
+
+# 预热时使用的默认序列长度分桶
+DEFAULT_WARMUP_BUCKETS = [64, 128, 256, 512]
+
+
+def _cpu_flags() -> set:
+    """读取 CPU 指令集标志（仅 Linux）"""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def cpu_supports_dtype(dtype_name: str) -> bool:
+    """判断当前 CPU 是否原生支持该精度的矩阵运算"""
+    if dtype_name == "float32":
+        return True
+    return bool(_cpu_flags() & set(_NATIVE_CPU_FLAGS.get(dtype_name, ())))
+
+
+class _BucketPaddingTokenizer:
+    """
+    tokenizer 代理：把序列长度补齐到 multiple 的整数倍
+
+    使推理输入只出现有限几种形状，编译后的计算图可以复用，不会因为每个批次长度不同而反复重新编译。
+    """
+
+    def __init__(self, tokenizer, multiple: int):
+        self._tokenizer = tokenizer
+        self._multiple = multiple
+
+    def __call__(self, *args, **kwargs):
+        kwargs.setdefault("pad_to_multiple_of", self._multiple)
+        return self._tokenizer(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._tokenizer, name)
+
+
+class _TracedSequenceClassifier(torch.nn.Module):
+    """
+    包装 TorchScript 模型，使其与 CrossEncoder 期望的 HF 模型接口一致
+    （接受 **features 关键字参数，返回带 logits 的输出对象）
+    """
+
+    def __init__(self, traced, config, input_names: List[str]):
+        super().__init__()
+        self.traced = traced
+        self.config = config
+        self.input_names = input_names
+
+    def forward(self, **features):
+        outputs = self.traced(*[features[name] for name in self.input_names])
+        logits = outputs["logits"] if isinstance(outputs, dict) else outputs[0]
+        return SequenceClassifierOutput(logits=logits)
+
+
+def _logits_to_fp32(module, inputs, outputs):
+    """前向 hook：降精度模型的 logits 转回 fp32，避免下游 numpy 转换不支持 bf16"""
+    outputs.logits = outputs.logits.float()
+    return outputs
+
+
+def _dummy_features(model, batch_size: int, seq_len: int) -> Dict[str, torch.Tensor]:
+    """构造指定形状的合成输入"""
+    sample = model.tokenizer([["query", "document"]], return_tensors="pt")
+    features = {}
+    for name, tensor in sample.items():
+        if name == "input_ids":
+            features[name] = torch.randint(5, model.tokenizer.vocab_size, (batch_size, seq_len))
+        else:
+            features[name] = torch.full((batch_size, seq_len), int(tensor[0, 0]), dtype=tensor.dtype)
+    features["attention_mask"] = torch.ones((batch_size, seq_len), dtype=torch.long)
+    return features
+
+
+def warmup_buckets(model, buckets: List[int], batch_sizes: List[int]):
+    """按序列长度分桶执行预热，把编译开销挪到启动阶段"""
+    hf_model = model.model
+    with torch.inference_mode():
+        for seq_len in buckets:
+            for batch_size in batch_sizes:
+                hf_model(**_dummy_features(model, batch_size, seq_len))
+    logger.info(f"🔥 预热完成 - 序列长度分桶: {buckets}, 批大小: {batch_sizes}")
+
+
+def optimize_model(model, config: Dict, model_name: str):
+    """
+    根据 SUPPORTED_MODELS 中的配置对已加载的 CrossEncoder 应用执行优化
+
+    支持的配置项：
+        dtype: "float32"（默认）/ "bfloat16" / "float16"，CPU 不原生支持时回退到 float32
+        compile: None（默认，eager）/ "torch.compile" / "torchscript"
+        warmup_buckets: 预热的序列长度分桶，默认 [64, 128, 256, 512]
+        warmup_batch_sizes: 预热的批大小，默认 [1, 32]
+
+    Args:
+        model: CrossEncoder 模型
+        config: 模型配置
+        model_name: 模型名称（仅用于日志）
+
+    Returns:
+        实际生效的执行模式
+    """
+    dtype_name = config.get("dtype", "float32")
+    compile_mode = config.get("compile")
+
+    if dtype_name not in SUPPORTED_DTYPES:
+        raise ValueError(f"不支持的精度: {dtype_name}. 支持的精度: {list(SUPPORTED_DTYPES.keys())}")
+    if dtype_name != "float32" and not cpu_supports_dtype(dtype_name) and not torch.cuda.is_available():
+        logger.warning(f"⚠️  当前 CPU 不原生支持 {dtype_name}，模型 [{model_name}] 回退到 float32")
+        dtype_name = "float32"
+
+    hf_model = model.model
+    hf_model.eval()
+    if dtype_name != "float32":
+        hf_model.to(SUPPORTED_DTYPES[dtype_name])
+        hf_model.register_forward_hook(_logits_to_fp32)
+
+    buckets = [b for b in config.get("warmup_buckets", DEFAULT_WARMUP_BUCKETS) if b <= model.max_length]
+    batch_sizes = config.get("warmup_batch_sizes", [1, 32])
+
+    if compile_mode:
+        # 把序列长度补齐到最小分桶的整数倍，限制输入形状的种类
+        model.tokenizer = _BucketPaddingTokenizer(model.tokenizer, min(buckets) if buckets else 64)
+
+    if compile_mode == "torch.compile":
+        model.model = torch.compile(hf_model, dynamic=True)
+    elif compile_mode == "torchscript":
+        example = _dummy_features(model, 1, min(buckets) if buckets else 64)
+        # 按 forward 的参数顺序传入位置参数
+        input_names = [n for n in inspect.signature(hf_model.forward).parameters if n in example]
+        with torch.inference_mode():
+            traced = torch.jit.trace(hf_model, tuple(example[n] for n in input_names), strict=False)
+        traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        model.model = _TracedSequenceClassifier(traced, hf_model.config, input_names)
+    elif compile_mode is not None:
+        raise ValueError(f"不支持的编译模式: {compile_mode}. 支持: torch.compile / torchscript")
+
+    if compile_mode and buckets:
+        warmup_buckets(model, buckets, batch_sizes)
+
+    mode = {"dtype": dtype_name, "compile": compile_mode}
+    logger.info(f"⚙️  模型 [{model_name}] 执行模式: {mode}")
+    return mode
+
+
+# ============== 精度校验 ==============
+
+def kendall_tau(a: List[float], b: List[float]) -> float:
+    """计算两组分数排序的 Kendall tau 相关系数"""
+    n = len(a)
+    if n < 2:
+        return 1.0
+    concordant = discordant = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            s = (a[i] - a[j]) * (b[i] - b[j])
+            if s > 0:
+                concordant += 1
+            elif s < 0:
+                discordant += 1
+    total = n * (n - 1) / 2
+    return (concordant - discordant) / total
+
+
+def ranking_agreement(
+    reference_scores: List[List[float]],
+    candidate_scores: List[List[float]],
+    top_n: int = 3
+) -> Dict:
+    """
+    对比优化模型与 fp32 基线在一组样本上的排序一致性
+
+    Args:
+        reference_scores: 每个样本（query）下 fp32 模型的文档分数
+        candidate_scores: 每个样本下优化模型的文档分数
+        top_n: 计算 top n 重合率时使用的 n
+
+    Returns:
+        平均 Kendall tau、top1 一致率、top n 重合率与最大分数偏差
+    """
+    taus, top1_matches, overlaps, max_diff = [], 0, [], 0.0
+    for ref, cand in zip(reference_scores, candidate_scores):
+        taus.append(kendall_tau(ref, cand))
+        ref_order = sorted(range(len(ref)), key=lambda i: ref[i], reverse=True)
+        cand_order = sorted(range(len(cand)), key=lambda i: cand[i], reverse=True)
+        top1_matches += int(ref_order[0] == cand_order[0])
+        n = min(top_n, len(ref))
+        overlaps.append(len(set(ref_order[:n]) & set(cand_order[:n])) / n)
+        max_diff = max(max_diff, max(abs(r - c) for r, c in zip(ref, cand)))
+
+    samples = len(taus)
+    return {
+        "samples": samples,
+        "mean_kendall_tau": sum(taus) / samples,
+        "min_kendall_tau": min(taus),
+        "top1_agreement": top1_matches / samples,
+        f"top{top_n}_overlap": sum(overlaps) / samples,
+        "max_abs_score_diff": max_diff,
+    }
+
+
+DEFAULT_ACCURACY_SAMPLES = [
+    {
+        "query": "什么是机器学习中的过拟合？",
+        "documents": [
+            "深度学习是机器学习的一个分支，使用多层神经网络。",
+            "过拟合是指模型在训练数据上表现很好，但在新数据上表现差。",
+            "Python 是一种流行的编程语言。",
+            "正则化是防止过拟合的常用技术。",
+            "卷积神经网络主要用于图像处理。",
+        ],
+    },
+    {
+        "query": "如何提高深度学习模型的泛化能力？",
+        "documents": [
+            "数据增强可以增加训练数据的多样性。",
+            "Dropout 是一种常用的正则化技术。",
+            "梯度下降是优化算法的基础。",
+            "Early Stopping 可以防止过拟合。",
+            "批归一化有助于训练稳定。",
+            "交叉验证用于评估模型性能。",
+            "L2 正则化通过惩罚大权重来防止过拟合。",
+            "集成学习可以提高模型鲁棒性。",
+        ],
+    },
+    {
+        "query": "What is AI?",
+        "documents": [
+            "Artificial intelligence is the simulation of human intelligence by machines.",
+            "The weather today is sunny.",
+            "Machine learning is a subset of AI.",
+            "Paris is the capital of France.",
+        ],
+    },
+]
+
+
+def load_accuracy_samples(path: Optional[str]) -> List[Dict]:
+    """读取精度校验样本（JSONL，每行包含 query 与 documents），未指定时使用内置样本"""
+    if not path:
+        return DEFAULT_ACCURACY_SAMPLES
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
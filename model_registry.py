@@ -0,0 +1,200 @@
+"""
+模型注册表
+保存已加载的模型实例及其版本与加载状态，支持在不中断服务的情况下原子替换模型：
+新版本在后台加载、预热完成后一次性切换，旧实例等在途请求全部结束后再释放。
+多 worker 部署时，热替换请求通过共享文件广播给所有 worker
+"""
+
+import gc
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持文件锁
+    fcntl = None
+
+LAUNCH_ID_ENV = "RERANK_LAUNCH_ID"  # 由启动进程生成，所有 worker 继承；区分不同次启动写入的广播
+
+
+def new_version() -> str:
+    """生成默认版本号（加载时间）"""
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+class ModelEntry:
+    """一个模型实例及其在途请求计数"""
+
+    def __init__(self, model, version: str):
+        self.model = model
+        self.version = version
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self.retired = False
+        self.drained = threading.Event()
+
+    def info(self) -> Dict:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "inflight_requests": self.inflight,
+        }
+
+
+class ModelRegistry:
+    """
+    线程安全的模型注册表
+
+    兼容原来的字典用法（`name in registry`、`registry[name]`、`registry[name] = model`、`keys()`），
+    推理路径通过 `use(name)` 获取模型，以便替换时知道旧实例何时不再被使用。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, ModelEntry] = {}
+        self._retiring: Dict[str, List[ModelEntry]] = {}
+        self._pending: Dict[str, Dict] = {}  # 正在后台加载的新版本 {name: {"version", "state", "error"}}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __getitem__(self, name: str):
+        return self._entries[name].model
+
+    def __setitem__(self, name: str, model):
+        self.swap(name, model, new_version())
+
+    def keys(self) -> List[str]:
+        return list(self._entries.keys())
+
+    @contextmanager
+    def use(self, name: str):
+        """在 with 块内占用模型当前版本，替换发生时旧版本会等待 with 块结束"""
+        with self._lock:
+            entry = self._entries[name]
+            entry.inflight += 1
+        try:
+            yield entry.model
+        finally:
+            with self._lock:
+                entry.inflight -= 1
+                if entry.retired and entry.inflight == 0:
+                    entry.drained.set()
+
+    def swap(self, name: str, model, version: str) -> Optional[ModelEntry]:
+        """
+        原子地把模型替换为新实例
+
+        Returns:
+            被替换下来的旧版本（需要调用 release_when_drained 释放），首次加载时为 None
+        """
+        with self._lock:
+            previous = self._entries.get(name)
+            self._entries[name] = ModelEntry(model, version)
+            self._pending.pop(name, None)
+            if previous is not None:
+                previous.retired = True
+                self._retiring.setdefault(name, []).append(previous)
+                if previous.inflight == 0:
+                    previous.drained.set()
+        return previous
+
+    def release_when_drained(self, name: str, entry: ModelEntry, timeout: Optional[float] = None) -> bool:
+        """
+        等待旧版本的在途请求全部结束后释放其权重
+
+        Args:
+            name: 模型名称
+            entry: swap 返回的旧版本
+            timeout: 最长等待时间（秒），超时后仍然释放注册表对它的引用
+
+        Returns:
+            是否在超时前排空
+        """
+        drained = entry.drained.wait(timeout)
+        with self._lock:
+            retiring = self._retiring.get(name, [])
+            if entry in retiring:
+                retiring.remove(entry)
+            if not retiring:
+                self._retiring.pop(name, None)
+        entry.model = None
+        gc.collect()
+        return drained
+
+    def set_pending(self, name: str, version: str, state: str, error: Optional[str] = None):
+        """记录后台加载中的新版本状态（loading / warming / failed）"""
+        with self._lock:
+            self._pending[name] = {"version": version, "state": state, "error": error}
+
+    def pending(self, name: str) -> Optional[Dict]:
+        return self._pending.get(name)
+
+    def status(self, name: str) -> Dict:
+        """模型当前版本、后台加载中的版本与排空中的旧版本"""
+        with self._lock:
+            entry = self._entries.get(name)
+            return {
+                "state": "ready" if entry else "not_loaded",
+                "current": entry.info() if entry else None,
+                "pending": dict(self._pending[name]) if name in self._pending else None,
+                "draining": [e.info() for e in self._retiring.get(name, [])],
+            }
+
+
+class ReloadBroadcast:
+    """
+    通过共享文件在 worker 之间广播热替换请求
+
+    文件内容为 {model_name: {"version": ..., "local_path": ..., "launch_id": ..., "published_at": ...}}，
+    只保留每个模型最新的请求。每个 worker 定期读取，发现与自己当前（或正在加载的）版本不同的请求时各自加载。
+    只采纳本次启动写入的请求：设置了 launch_id 时按 launch_id 匹配（被回收后重新拉起的 worker 继承同一个 launch_id，
+    仍会加载最新版本），否则忽略早于本进程启动时间的请求，避免服务重启后重新应用上一次运行留下的旧请求。
+    """
+
+    def __init__(self, path: str, launch_id: Optional[str] = None):
+        """
+        Args:
+            path: 共享文件路径
+            launch_id: 本次启动的标识，为空时按进程启动时间过滤
+        """
+        self.path = path
+        self.launch_id = launch_id
+        self.started_at = time.time()
+
+    def _is_current(self, request: Dict) -> bool:
+        """请求是否由本次启动写入"""
+        if self.launch_id:
+            return request.get("launch_id") == self.launch_id
+        return request.get("published_at", 0) >= self.started_at
+
+    def publish(self, name: str, version: str, local_path: Optional[str]):
+        """记录模型的最新热替换请求（加文件锁读-改-写，原子替换）"""
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # 上一次运行留下的请求在写入时一并清理
+            requests = self.read()
+            requests[name] = {
+                "version": version,
+                "local_path": local_path,
+                "launch_id": self.launch_id,
+                "published_at": time.time(),
+            }
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(requests, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def read(self) -> Dict[str, Dict]:
+        """读取本次启动写入的各模型最新热替换请求，文件不存在时返回空"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                requests = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {name: request for name, request in requests.items() if self._is_current(request)}
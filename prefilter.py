@@ -0,0 +1,104 @@
+"""
+双塔向量预筛选
+用小型 bi-encoder 对 query 和文档做向量相似度粗排，只把 top K 送入 cross-encoder 精排，
+使精排成本不再随候选文档数线性增长
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """按文档内容哈希缓存向量的 LRU 缓存"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is not None:
+                self._data.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class EmbeddingPrefilter:
+    """
+    向量预筛选器
+
+    文档向量按内容缓存，重复出现的候选文档只需编码一次；
+    query 与未命中缓存的文档在同一次 encode 调用中批量编码。
+    """
+
+    def __init__(self, model_path: str, cache_size: int = 100000):
+        self.model_path = model_path
+        self.model = SentenceTransformer(model_path)
+        self.cache = EmbeddingCache(cache_size)
+        logger.info(f"🎉 预筛选模型 [{model_path}] 加载成功！")
+
+    def select(self, query: str, documents: List[str], top_k: int) -> Tuple[List[int], Dict]:
+        """
+        选出与 query 余弦相似度最高的 top_k 个文档
+
+        Args:
+            query: 查询文本
+            documents: 候选文档列表
+            top_k: 保留的文档数
+
+        Returns:
+            (保留文档在原始列表中的索引, 统计信息)
+        """
+        keys = [EmbeddingCache.key(doc) for doc in documents]
+        vectors: List = [self.cache.get(k) for k in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+
+        # 相同文本只编码一次
+        unique_missing: Dict[str, int] = {}
+        for i in missing:
+            unique_missing.setdefault(keys[i], i)
+        to_encode = [query] + [documents[i] for i in unique_missing.values()]
+        encoded = self.model.encode(to_encode, normalize_embeddings=True, convert_to_numpy=True)
+
+        query_vector = encoded[0]
+        fresh = dict(zip(unique_missing.keys(), encoded[1:]))
+        for key, vector in fresh.items():
+            self.cache.put(key, vector)
+        for i in missing:
+            vectors[i] = fresh[keys[i]]
+
+        similarities = np.stack(vectors) @ query_vector
+        top_k = min(top_k, len(documents))
+        selected = np.argpartition(-similarities, top_k - 1)[:top_k]
+        selected = selected[np.argsort(-similarities[selected])]
+
+        stats = {
+            "candidates": len(documents),
+            "kept": int(top_k),
+            "cache_hits": len(documents) - len(missing),
+            "similarity_cutoff": float(similarities[selected[-1]]),
+        }
+        return [int(i) for i in selected], stats
@@ -0,0 +1,178 @@
+"""
+在线性能剖析
+对运行中的进程做限时采集：Python 调用栈采样、CrossEncoder 前向计算的 torch 算子耗时、
+以及内存分配统计，结果打包为 zip 文件下载。
+未在采集时只有一次布尔判断，没有额外开销
+"""
+
+import io
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import torch
+
+MAX_CAPTURE_SECONDS = 120
+
+
+class ProfilerBusy(Exception):
+    """已有采集正在进行"""
+
+
+class LiveProfiler:
+    """
+    限时在线剖析器
+
+    start() 之后：
+        - 后台线程按固定间隔采样所有线程的 Python 调用栈（折叠格式，可直接生成火焰图）
+        - operator_profile() 包裹的模型前向计算会被 torch.profiler 记录（同一时刻只记录一个调用）
+        - tracemalloc 记录内存分配
+    stop() 停止采集并返回 zip 文件内容。
+    """
+
+    def __init__(self):
+        self.active = False
+        self._lock = threading.Lock()
+        self._torch_lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._torch_ops: Dict[str, Dict] = {}
+        self._torch_calls = 0
+        self._started_at = 0.0
+        self._interval = 0.005
+
+    def start(self, interval: float = 0.005, trace_allocations: bool = True):
+        """开始采集；已有采集进行中时抛出 ProfilerBusy"""
+        with self._lock:
+            if self.active:
+                raise ProfilerBusy("已有剖析任务正在进行")
+            self._stacks = Counter()
+            self._samples = 0
+            self._torch_ops = {}
+            self._torch_calls = 0
+            self._interval = interval
+            self._started_at = time.time()
+            self._stop_event.clear()
+            if trace_allocations:
+                tracemalloc.start(25)
+            self._sampler = threading.Thread(target=self._sample_loop, name="live-profiler", daemon=True)
+            self._sampler.start()
+            self.active = True
+
+    def stop(self) -> bytes:
+        """停止采集，返回 zip 文件内容"""
+        with self._lock:
+            self.active = False
+            self._stop_event.set()
+            self._sampler.join()
+            allocations = None
+            if tracemalloc.is_tracing():
+                allocations = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            # 等待正在记录的算子剖析结束
+            with self._torch_lock:
+                pass
+            return self._build_artifact(allocations)
+
+    def _sample_loop(self):
+        """采样线程：周期性记录所有线程的调用栈"""
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self._interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+            self._samples += 1
+
+    @contextmanager
+    def operator_profile(self):
+        """包裹模型前向计算；未采集或已有调用在记录时直接执行"""
+        if not self.active or not self._torch_lock.acquire(blocking=False):
+            yield
+            return
+        if not self.active:
+            # 获取锁之前 stop() 已经通过屏障并开始打包结果，不能再写入算子统计
+            self._torch_lock.release()
+            yield
+            return
+        try:
+            with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU],
+                record_shapes=True
+            ) as prof:
+                yield
+            self._merge_torch_events(prof.key_averages(group_by_input_shape=True))
+        finally:
+            self._torch_lock.release()
+
+    def _merge_torch_events(self, events):
+        """累计每个算子（按输入形状分组）的调用次数与耗时"""
+        self._torch_calls += 1
+        for event in events:
+            key = f"{event.key} {event.input_shapes}"
+            entry = self._torch_ops.setdefault(
+                key, {"op": event.key, "input_shapes": str(event.input_shapes),
+                      "count": 0, "cpu_time_total_us": 0.0, "self_cpu_time_total_us": 0.0}
+            )
+            entry["count"] += event.count
+            entry["cpu_time_total_us"] += event.cpu_time_total
+            entry["self_cpu_time_total_us"] += event.self_cpu_time_total
+
+    def _build_artifact(self, allocations) -> bytes:
+        """把采集结果打包为 zip"""
+        duration = time.time() - self._started_at
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            # Python 调用栈（折叠格式，可用 flamegraph.pl / speedscope 打开）
+            archive.writestr(
+                "python_stacks.collapsed",
+                "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common())
+            )
+
+            # 各函数作为栈顶（self）出现的次数
+            self_counts = Counter()
+            for stack, count in self._stacks.items():
+                self_counts[stack.rsplit(";", 1)[-1]] += count
+            archive.writestr(
+                "python_top.txt",
+                "\n".join(
+                    f"{count / max(1, self._samples) * 100:6.2f}%  {count:8d}  {func}"
+                    for func, count in self_counts.most_common(100)
+                )
+            )
+
+            ops = sorted(self._torch_ops.values(), key=lambda e: e["self_cpu_time_total_us"], reverse=True)
+            archive.writestr("torch_ops.json", json.dumps(ops, ensure_ascii=False, indent=2))
+
+            if allocations is not None:
+                top = allocations.statistics("traceback")[:50]
+                lines = []
+                for stat in top:
+                    lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+                    lines.extend(f"    {line}" for line in stat.traceback.format())
+                archive.writestr("allocations.txt", "\n".join(lines))
+
+            archive.writestr("summary.json", json.dumps({
+                "pid": os.getpid(),
+                "started_at": self._started_at,
+                "duration_seconds": duration,
+                "sample_interval_seconds": self._interval,
+                "python_samples": self._samples,
+                "profiled_forward_calls": self._torch_calls,
+                "allocations_traced": allocations is not None,
+            }, indent=2))
+        return buffer.getvalue()
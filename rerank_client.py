@@ -1,6 +1,7 @@
 import asyncio
+import itertools
 import aiohttp
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class RerankResult:
     """重排结果"""
@@ -20,7 +21,8 @@ class RerankClient:
         self,
         base_url: str = "http://127.0.0.1:8000",
         api_key: Optional[str] = None,
-        timeout: int = 20
+        timeout: int = 20,
+        transport: str = "http"
     ):
         """
         初始化客户端
@@ -29,10 +31,23 @@ class RerankClient:
             base_url: API 基础 URL
             api_key: API Key（可选）
             timeout: 请求超时时间（秒）
+            transport: "http"（每次调用一个 HTTP 请求）或 "websocket"
+                       （复用一条持久连接，只认证一次，多个调用并发流水线发送，适合高频调用）
         """
+        if transport not in ("http", "websocket"):
+            raise ValueError(f"不支持的传输方式: {transport}")
+        
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
         self.timeout = timeout
+        self.transport = transport
+        
+        # WebSocket 连接状态
+        self._ws = None
+        self._ws_reader = None
+        self._ws_lock = asyncio.Lock()
+        self._ws_pending: Dict[str, asyncio.Future] = {}
+        self._ws_ids = itertools.count()
         
         # 构建请求头
         headers = {"Content-Type": "application/json"}
@@ -72,6 +87,9 @@ class RerankClient:
         if top_n is not None:
             payload["top_n"] = top_n
         
+        if self.transport == "websocket":
+            return await self._rerank_ws(payload)
+        
         try:
             async with self.session.post(
                 f"{self.base_url}/v1/rerank",
@@ -99,6 +117,64 @@ class RerankClient:
             print(f"❌ Rerank 请求失败: {e}")
             raise
     
+    async def _connect_ws(self):
+        """建立 WebSocket 连接（认证信息随握手的 Authorization 头发送）"""
+        async with self._ws_lock:
+            if self._ws is not None and not self._ws.closed:
+                return self._ws
+            ws_url = self.base_url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+            self._ws = await self.session.ws_connect(f"{ws_url}/v1/rerank/ws", heartbeat=30)
+            self._ws_reader = asyncio.ensure_future(self._read_ws())
+            return self._ws
+    
+    async def _read_ws(self):
+        """后台读取 WebSocket 响应，按 id 分发给等待中的调用（响应可能乱序）"""
+        ws = self._ws
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                data = message.json()
+                future = self._ws_pending.pop(data.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(data)
+        finally:
+            # 连接断开或收到无法处理的消息：关闭连接，让所有等待中的调用失败，下次调用时重新连接
+            if self._ws is ws:
+                self._ws = None
+            await ws.close()
+            for future in self._ws_pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("WebSocket 连接已断开"))
+            self._ws_pending.clear()
+    
+    async def _rerank_ws(self, payload: dict) -> List[RerankResult]:
+        """通过 WebSocket 发送一个重排消息并等待对应 id 的响应"""
+        ws = await self._connect_ws()
+        
+        message_id = str(next(self._ws_ids))
+        future = asyncio.get_event_loop().create_future()
+        self._ws_pending[message_id] = future
+        try:
+            await ws.send_json({"id": message_id, **payload})
+            data = await asyncio.wait_for(future, timeout=self.timeout)
+        except Exception as e:
+            self._ws_pending.pop(message_id, None)
+            print(f"❌ Rerank 请求失败: {e}")
+            raise
+        
+        if "error" in data:
+            error = data["error"]
+            raise Exception(f"API 错误 {error.get('status_code')}: {error.get('detail')}")
+        
+        return [
+            RerankResult(
+                index=r["index"],
+                relevance_score=r["relevance_score"]
+            )
+            for r in data.get("results", [])
+        ]
+    
     async def health_check(self) -> bool:
         """检查服务是否运行"""
         try:
@@ -109,6 +185,12 @@ class RerankClient:
     
     async def close(self):
         """关闭客户端会话"""
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+        if self._ws_reader is not None:
+            await asyncio.gather(self._ws_reader, return_exceptions=True)
+            self._ws_reader = None
         if self.session:
             await self.session.close()
             self.session = None
@@ -271,6 +353,36 @@ async def batch_example():
         await client.close()
 
 
+async def websocket_example():
+    """WebSocket 持久连接示例（适合高频调用）"""
+    print("="*60)
+    print("WebSocket 持久连接示例")
+    print("="*60 + "\n")
+    
+    # 只在建立连接时认证一次，之后所有调用复用同一条连接
+    client = RerankClient(transport="websocket")
+    
+    try:
+        documents = [
+            "机器学习是人工智能的一个分支。",
+            "过拟合可以通过正则化解决。",
+            "梯度下降是常用的优化算法。"
+        ]
+        queries = [f"机器学习问题 {i}" for i in range(20)]
+        
+        # 多个调用在同一连接上流水线发送，响应按完成顺序返回并按 id 对应
+        results_list = await asyncio.gather(*[
+            client.rerank(query, documents, top_n=1)
+            for query in queries
+        ])
+        
+        print(f"通过 1 条连接完成 {len(results_list)} 次重排")
+        print(f"第一个查询的最相关文档: {documents[results_list[0][0].index]}")
+    
+    finally:
+        await client.close()
+
+
 # 同步包装器（适配非异步环境）
 class SyncRerankClient:
     """同步版本的 Rerank 客户端（使用 requests）"""
@@ -358,6 +470,8 @@ async def main():
     await rag_example()
     print("\n")
     await batch_example()
+    print("\n")
+    await websocket_example()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,35 @@
-from fastapi import FastAPI, HTTPException, Header, Depends
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Optional, Union
+from contextlib import contextmanager
+from functools import partial
 import uvicorn
+import torch
 from sentence_transformers import CrossEncoder
 import logging
 import os
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+
+import cpu_tuning
+import model_optimization
+from autotune import BatchAutotuner
+from dedup import PairSingleFlight
+from document_store import DocumentStore
+from late_interaction import LateInteractionEncoder, maxsim_scores
+from memory_watchdog import MemoryWatchdog
+from profiling import LiveProfiler, ProfilerBusy, MAX_CAPTURE_SECONDS
+from model_registry import LAUNCH_ID_ENV, ModelRegistry, ReloadBroadcast, new_version
+from admission import AdmissionController, AdmissionRejected, estimate_cost
+from prefilter import EmbeddingPrefilter
 
 # 配置日志
 logging.basicConfig(
@@ -20,10 +45,84 @@ app = FastAPI(
     version="1.0.0"
 )
 
+
+def uvicorn_version() -> tuple:
+    """已安装 uvicorn 的 (主版本, 次版本)，无法解析时视为满足要求"""
+    try:
+        return tuple(int(part) for part in uvicorn.__version__.split(".")[:2])
+    except ValueError:
+        return (999, 0)
+
+
+# uvicorn 0.30 起多 worker 模式才会拉起新进程替换退出的 worker，更早的版本回收后 worker 数只减不增
+UVICORN_REPLACES_WORKERS = uvicorn_version() >= (0, 30)
+
 # 全局变量
-rerank_models = {}  # 模型缓存字典 {model_name: CrossEncoder}
+rerank_models = ModelRegistry()  # 模型注册表，兼容字典用法 {model_name: CrossEncoder}，支持热替换
 default_model_name = None  # 默认模型名称
+model_execution_modes = {}  # 模型实际生效的执行模式 {model_name: {"dtype": ..., "compile": ...}}
+pair_dedup = PairSingleFlight()  # 请求内与并发请求间的重复 (query, document) 对只计算一次
+live_profiler = LiveProfiler()  # 在线剖析器，仅在管理接口触发采集时工作
+memory_watchdog = MemoryWatchdog(
+    max_rss_bytes=int(float(os.getenv("RERANK_MAX_RSS_MB", "0")) * 1024 * 1024),  # RSS 上限，0 表示不限制
+    check_interval=float(os.getenv("RERANK_MEMORY_CHECK_INTERVAL", "30")),  # 检查间隔（秒）
+    trim_interval=float(os.getenv("RERANK_MEMORY_TRIM_INTERVAL", "300")),  # 定期回收空闲内存的间隔（秒）
+    models_fn=lambda: {name: rerank_models[name] for name in rerank_models.keys()},
+    # 超过上限退出进程只在有进程管理器替换时安全：多 worker 模式，或显式声明由外部管理器（systemd / k8s）重启
+    recycle=(
+        (int(os.getenv(cpu_tuning.WORKERS_ENV, "1") or 1) > 1 and UVICORN_REPLACES_WORKERS)
+        or os.getenv("RERANK_EXTERNAL_SUPERVISOR", "0") == "1"
+    )
+)
+batch_autotuner = BatchAutotuner(
+    batch_sizes=[int(x) for x in os.getenv("RERANK_AUTOTUNE_BATCH_SIZES", "4,8,16,32,64,128").split(",")],  # 批大小候选档位
+    initial_batch_size=int(os.getenv("RERANK_BATCH_SIZE", "32")),  # 初始批大小（关闭调优时固定使用）
+    max_wait_seconds=float(os.getenv("RERANK_AUTOTUNE_MAX_WAIT_MS", "10")) / 1000,  # 小请求凑批的最长等待
+    latency_slo_seconds=float(os.getenv("RERANK_AUTOTUNE_LATENCY_SLO_MS", "1000")) / 1000,  # p95 批延迟上限，0 表示不限制
+    window=int(os.getenv("RERANK_AUTOTUNE_WINDOW", "20")),  # 每多少个前向批次评估一次
+    enabled=os.getenv("RERANK_AUTOTUNE", "1") == "1"
+)
+model_load_lock = threading.Lock()  # 推理在线程池中执行，避免并发请求重复加载同一模型
 API_KEY = os.getenv("RERANK_API_KEY", "")  # 从环境变量读取 API Key
+ADMIN_API_KEY = os.getenv("RERANK_ADMIN_API_KEY", "")  # 管理接口 API Key，未设置时管理接口不可用
+WS_MAX_INFLIGHT = int(os.getenv("RERANK_WS_MAX_INFLIGHT", "64"))  # WebSocket 单连接最多同时处理的消息数
+MODEL_DRAIN_TIMEOUT = float(os.getenv("RERANK_MODEL_DRAIN_TIMEOUT", "300"))  # 热替换时等待旧模型请求结束的最长秒数
+# 多 worker 时热替换请求写入共享文件，各 worker 按间隔轮询后各自加载
+model_reload_broadcast = ReloadBroadcast(
+    os.getenv("RERANK_MODEL_RELOAD_FILE", "model_reload.json"),
+    launch_id=os.getenv(LAUNCH_ID_ENV)
+)
+MODEL_RELOAD_POLL_INTERVAL = float(os.getenv("RERANK_MODEL_RELOAD_POLL_INTERVAL", "5"))
+
+# 向量预筛选配置
+PREFILTER_MODEL = os.getenv("RERANK_PREFILTER_MODEL", "BAAI/bge-small-zh-v1.5")  # 小型 bi-encoder
+PREFILTER_TOP_K = int(os.getenv("RERANK_PREFILTER_TOP_K", "0"))  # 默认预筛选数量，0 表示不启用
+PREFILTER_CACHE_SIZE = int(os.getenv("RERANK_PREFILTER_CACHE_SIZE", "100000"))  # 文档向量缓存条数
+PREFILTER_AUDIT_RATE = float(os.getenv("RERANK_PREFILTER_AUDIT_RATE", "0"))  # 抽样计算召回率的请求比例
+prefilter = None  # 预筛选器，首次使用时加载
+prefilter_lock = threading.Lock()
+prefilter_audit = {"audited_requests": 0, "recall_sum": 0.0}  # 召回率审计累计值
+prefilter_audit_lock = threading.Lock()  # 保护审计累计值
+prefilter_audit_slot = threading.Lock()  # 同一时刻最多一个后台审计，限制额外的推理开销
+
+# 服务端文档存储
+DOCUMENT_STORE_DIR = os.getenv("RERANK_DOCUMENT_STORE_DIR", "document_store")  # 存储目录
+document_store = None  # 首次使用时打开
+document_store_lock = threading.Lock()
+
+# late-interaction 打分
+SCORING_MODES = ("cross_encoder", "late_interaction")
+late_interaction_encoders = {}  # {编码器名称: LateInteractionEncoder}
+late_interaction_failures = {}  # {编码器名称: {"at": 失败时间（monotonic）, "error": 原因}}，退避期过后重试加载
+LATE_INTERACTION_RETRY_SECONDS = float(os.getenv("RERANK_LATE_INTERACTION_RETRY_SECONDS", "300"))
+late_interaction_loading = {}  # {编码器名称: threading.Event}，正在后台加载的编码器，加载结束（成功或失败）时 set
+late_interaction_lock = threading.Lock()  # 只保护上面几个字典，编码器在后台线程中加载，不持有该锁
+
+# 准入控制配置（成本单位为近似 token 数）
+admission = AdmissionController(
+    max_inflight_cost=int(os.getenv("RERANK_MAX_INFLIGHT_COST", "0")),  # 0 表示不限制
+    max_queue_wait=float(os.getenv("RERANK_ADMISSION_QUEUE_WAIT", "0"))  # 预算不足时最长排队秒数
+)
 
 # 支持的模型配置
 SUPPORTED_MODELS = {
@@ -37,27 +136,77 @@ SUPPORTED_MODELS = {
         "remote_name": "BAAI/bge-reranker-large",
         "max_length": 512
     },
+    # 可选执行模式（默认 float32 + eager）：
+    #   "dtype": "bfloat16" / "float16"，CPU 不原生支持时自动回退到 float32
+    #   "compile": "torch.compile" / "torchscript"，启动时按 "warmup_buckets" 分桶预热
+    # 启用前建议先运行 python rerank_server.py --check-accuracy <模型名> 校验排序一致性
     "BAAI/bge-reranker-v2-m3": {
         "local_path": "models/bge-reranker-v2-m3",
         "remote_name": "BAAI/bge-reranker-v2-m3",
-        "max_length": 512
+        "max_length": 512,
+        # 请求 scoring="late_interaction" 时使用的多向量编码器（同系列的 BGE-M3）
+        "late_interaction": {
+            "local_path": "models/bge-m3",
+            "remote_name": "BAAI/bge-m3"
+        }
     }
 }
 
+# 引用服务端已注册的文档
+class DocumentRef(BaseModel):
+    id: str = Field(..., min_length=1, description="通过 /v1/documents 注册的文档 id")
+
 # 请求模型（兼容 VLLM 格式）
 class RerankRequest(BaseModel):
     query: str = Field(..., description="查询文本")
-    documents: List[str] = Field(..., description="待重排的文档列表")
+    documents: List[Union[str, DocumentRef]] = Field(
+        ..., description="待重排的文档列表，每项可以是文本，也可以是已注册文档的引用 {\"id\": \"...\"}"
+    )
     model: Optional[str] = Field("BAAI/bge-reranker-base", description="模型名称（仅用于日志）")
     top_n: Optional[int] = Field(None, description="返回前 n 个结果")
+    prefilter_top_k: Optional[int] = Field(
+        None,
+        description=(
+            "向量预筛选保留的文档数，只有这些文档进入 cross-encoder；0 表示关闭，默认使用服务端配置。"
+            "预筛选召回率按 RERANK_PREFILTER_AUDIT_RATE（默认 0，即不审计）抽样在后台计算，只在 GET / 中汇总"
+        )
+    )
+    scoring: Optional[str] = Field(
+        None,
+        description="打分方式：cross_encoder（默认）或 late_interaction（仅 bge-reranker-v2-m3 系列，不可用时退回 cross_encoder）"
+    )
 
 # 响应模型（兼容 VLLM 格式）
 class RerankResultItem(BaseModel):
     index: int = Field(..., description="文档在原始列表中的索引")
     relevance_score: float = Field(..., description="相关性分数")
 
+class PrefilterStats(BaseModel):
+    candidates: int = Field(..., description="预筛选前的文档数")
+    kept: int = Field(..., description="进入 cross-encoder 的文档数")
+    cache_hits: int = Field(..., description="命中向量缓存的文档数")
+    similarity_cutoff: float = Field(..., description="保留文档中最低的余弦相似度")
+
 class RerankResponse(BaseModel):
     results: List[RerankResultItem] = Field(..., description="重排结果列表")
+    prefilter: Optional[PrefilterStats] = Field(None, description="向量预筛选统计（仅在启用预筛选时返回）")
+    scoring: Optional[str] = Field(None, description="实际使用的打分方式（仅在请求指定 scoring 时返回）")
+
+# 文档注册请求
+class DocumentItem(BaseModel):
+    id: str = Field(..., min_length=1, description="文档 id")
+    text: str = Field(..., description="文档文本")
+
+class DocumentRegisterRequest(BaseModel):
+    documents: List[DocumentItem] = Field(..., description="待注册的文档列表，id 已存在时覆盖")
+    models: Optional[List[str]] = Field(None, description="为这些模型预先分词，默认使用默认模型")
+    late_interaction: bool = Field(False, description="同时为支持 late-interaction 打分的模型预先计算文档 token 向量")
+
+# 管理接口：模型热替换请求
+class ModelReloadRequest(BaseModel):
+    model: str = Field(..., description="要重新加载的模型名称")
+    local_path: Optional[str] = Field(None, description="新版本权重所在目录，默认使用 SUPPORTED_MODELS 中的路径")
+    version: Optional[str] = Field(None, description="新版本号，默认使用加载时间")
 
 # API Key 验证（可选）
 async def verify_api_key(authorization: Optional[str] = Header(None)):
@@ -77,12 +226,26 @@ async def verify_api_key(authorization: Optional[str] = Header(None)):
     
     return True
 
-def load_single_model(model_name: str) -> CrossEncoder:
+async def verify_admin_key(authorization: Optional[str] = Header(None)):
+    """验证管理接口的 API Key（未设置 RERANK_ADMIN_API_KEY 时管理接口不可用）"""
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="管理接口未启用，请设置 RERANK_ADMIN_API_KEY")
+    if not authorization:
+        raise HTTPException(status_code=401, detail="未提供 Authorization header")
+    
+    token = authorization[7:] if authorization.startswith("Bearer ") else authorization
+    if token != ADMIN_API_KEY:
+        raise HTTPException(status_code=401, detail="无效的管理 API Key")
+    
+    return True
+
+def load_single_model(model_name: str, overrides: Optional[dict] = None) -> CrossEncoder:
     """
     加载单个模型
     
     Args:
         model_name: 模型名称
+        overrides: 覆盖 SUPPORTED_MODELS 中的配置项（例如精度校验时强制 float32）
     
     Returns:
         加载好的 CrossEncoder 模型
@@ -90,11 +253,15 @@ def load_single_model(model_name: str) -> CrossEncoder:
     if model_name not in SUPPORTED_MODELS:
         raise ValueError(f"不支持的模型: {model_name}. 支持的模型: {list(SUPPORTED_MODELS.keys())}")
     
-    config = SUPPORTED_MODELS[model_name]
+    config = {**SUPPORTED_MODELS[model_name], **(overrides or {})}
     local_path = config["local_path"]
     remote_name = config["remote_name"]
     max_length = config["max_length"]
     
+    # 显式指定的路径（例如热替换的新版本）不存在时直接报错，不能退回下载基础模型
+    if overrides and "local_path" in overrides and not os.path.isdir(local_path):
+        raise FileNotFoundError(f"指定的模型目录不存在: {local_path}")
+    
     # 优先使用本地模型
     if os.path.exists(local_path) and os.path.isdir(local_path):
         logger.info(f"✅ 发现本地模型: {local_path}")
@@ -105,16 +272,335 @@ def load_single_model(model_name: str) -> CrossEncoder:
         model_path = remote_name
     
     model = CrossEncoder(model_path, max_length=max_length)
+    
+    # 降精度 / 图优化
+    model_execution_modes[model_name] = model_optimization.optimize_model(model, config, model_name)
     logger.info(f"🎉 模型 [{model_name}] 加载成功！")
     
     return model
 
 
+def get_prefilter() -> EmbeddingPrefilter:
+    """获取预筛选器，首次调用时加载 bi-encoder"""
+    global prefilter
+    with prefilter_lock:
+        if prefilter is None:
+            logger.info(f"🔄 正在加载预筛选模型: {PREFILTER_MODEL}")
+            prefilter = EmbeddingPrefilter(PREFILTER_MODEL, cache_size=PREFILTER_CACHE_SIZE)
+    return prefilter
+
+
+def get_document_store() -> DocumentStore:
+    """获取文档存储，首次调用时打开"""
+    global document_store
+    with document_store_lock:
+        if document_store is None:
+            document_store = DocumentStore(DOCUMENT_STORE_DIR)
+            logger.info(f"📚 文档存储已打开: {DOCUMENT_STORE_DIR}")
+    return document_store
+
+
+def tokenizer_key(model_name: str) -> str:
+    """文档存储中区分不同模型分词结果的 key"""
+    return model_name.replace("/", "__")
+
+
+def get_late_interaction_encoder(model_name: str, wait: bool = False) -> Optional[LateInteractionEncoder]:
+    """
+    获取模型对应的多向量编码器，首次调用时在后台线程中开始加载
+    
+    编码器约 2.2GB，加载期间请求不等待，直接返回 None（退回 cross-encoder）。
+    模型不支持或加载失败时返回 None；失败后在退避期内直接返回 None，退避期过后重新尝试加载。
+    
+    Args:
+        model_name: 模型名称
+        wait: 是否等待后台加载结束（注册文档时需要编码器，只阻塞调用方自己）
+    """
+    config = SUPPORTED_MODELS[model_name].get("late_interaction")
+    if config is None:
+        return None
+    name = config["remote_name"]
+    with late_interaction_lock:
+        if name in late_interaction_encoders:
+            return late_interaction_encoders[name]
+        failure = late_interaction_failures.get(name)
+        if failure and time.monotonic() - failure["at"] < LATE_INTERACTION_RETRY_SECONDS:
+            return None
+        loading = late_interaction_loading.get(name)
+        if loading is None:
+            loading = threading.Event()
+            late_interaction_loading[name] = loading
+            threading.Thread(
+                target=load_late_interaction_encoder,
+                args=(model_name, loading),
+                name=f"load-{name}",
+                daemon=True
+            ).start()
+    if not wait:
+        return None
+    loading.wait()
+    return late_interaction_encoders.get(name)
+
+
+def load_late_interaction_encoder(model_name: str, loading: threading.Event):
+    """后台加载多向量编码器，结束后 set loading"""
+    config = SUPPORTED_MODELS[model_name]["late_interaction"]
+    name = config["remote_name"]
+    path = config["local_path"] if os.path.isdir(config["local_path"]) else name
+    logger.info(f"🔄 正在后台加载 late-interaction 编码器: {path}")
+    try:
+        encoder = LateInteractionEncoder(path, max_length=SUPPORTED_MODELS[model_name]["max_length"])
+        with late_interaction_lock:
+            late_interaction_encoders[name] = encoder
+            late_interaction_failures.pop(name, None)
+        logger.info(f"✅ late-interaction 编码器加载完成: {path}")
+    except Exception as e:
+        logger.error(
+            f"❌ late-interaction 编码器加载失败，将使用 cross-encoder，"
+            f"{LATE_INTERACTION_RETRY_SECONDS:.0f} 秒后重试: {str(e)}"
+        )
+        with late_interaction_lock:
+            late_interaction_failures[name] = {"at": time.monotonic(), "error": str(e)}
+    finally:
+        with late_interaction_lock:
+            late_interaction_loading.pop(name, None)
+        loading.set()
+
+
+def late_interaction_status(model_name: str) -> Optional[dict]:
+    """模型多向量编码器的实际状态（loaded / loading / not_loaded / failed），模型不支持时为 None"""
+    config = SUPPORTED_MODELS[model_name].get("late_interaction")
+    if config is None:
+        return None
+    name = config["remote_name"]
+    if name in late_interaction_encoders:
+        return {"encoder": name, "state": "loaded"}
+    if name in late_interaction_loading:
+        return {"encoder": name, "state": "loading"}
+    failure = late_interaction_failures.get(name)
+    if failure:
+        retry_in = LATE_INTERACTION_RETRY_SECONDS - (time.monotonic() - failure["at"])
+        if retry_in > 0:
+            return {"encoder": name, "state": "failed", "error": failure["error"], "retry_in_seconds": round(retry_in)}
+        # 退避期已过，下一个请求会在后台重新尝试加载
+        return {"encoder": name, "state": "not_loaded", "last_error": failure["error"]}
+    return {"encoder": name, "state": "not_loaded"}
+
+
+def encoder_key(model_name: str) -> str:
+    """文档存储中区分不同编码器 token 向量的 key"""
+    return tokenizer_key(SUPPORTED_MODELS[model_name]["late_interaction"]["remote_name"])
+
+
+@contextmanager
+def use_rerank_model(model_name: str):
+    """
+    获取模型并在 with 块内占用当前版本，未加载时动态加载
+    
+    热替换期间旧版本会等待所有占用结束后才被释放。
+    """
+    # 已加载的模型不经过加载锁，冷启动加载期间其它模型的请求不受影响
+    if model_name not in rerank_models:
+        with model_load_lock:
+            if model_name not in rerank_models:
+                logger.info(f"🔄 模型 [{model_name}] 未加载，正在动态加载...")
+                rerank_models[model_name] = load_single_model(model_name)
+    with rerank_models.use(model_name) as model:
+        yield model
+
+
+def score_pairs(
+    model: CrossEncoder,
+    pairs: List[List[str]],
+    batch_size: int = 32,
+    model_name: Optional[str] = None
+) -> List[float]:
+    """
+    计算 (query, document) 对的相关性分数
+
+    按文本长度排序后再分批推理，使同一批次内的 padding 最少，结果按原顺序返回。
+
+    Args:
+        model: CrossEncoder 模型
+        pairs: [query, document] 列表
+        batch_size: 推理批大小
+        model_name: 模型名称；指定时由自动调优器决定批大小，并与并发的小请求合并推理
+
+    Returns:
+        与 pairs 一一对应的分数列表
+    """
+    if model_name is not None:
+        return batch_autotuner.run(model_name, model, pairs, _predict_pairs)
+    return _predict_pairs(model, pairs, batch_size)
+
+
+def _predict_pairs(model: CrossEncoder, pairs: List[List[str]], batch_size: int) -> List[float]:
+    """按长度排序后分批推理"""
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+    with live_profiler.operator_profile():
+        sorted_scores = model.predict([pairs[i] for i in order], batch_size=batch_size)
+    scores = [0.0] * len(pairs)
+    for i, score in zip(order, sorted_scores):
+        scores[i] = float(score)
+    return scores
+
+
+def _activation(model: CrossEncoder):
+    """CrossEncoder 对 logits 使用的激活函数（兼容不同版本的 sentence-transformers）"""
+    for name in ("activation_fn", "activation_fct", "default_activation_function"):
+        fn = getattr(model, name, None)
+        if fn is not None:
+            return fn
+    return torch.nn.Sigmoid() if model.config.num_labels == 1 else torch.nn.Identity()
+
+
+def score_token_pairs(
+    model: CrossEncoder,
+    query: str,
+    doc_tokens: List,
+    batch_size: int = 32,
+    model_name: Optional[str] = None
+) -> List[float]:
+    """
+    用预先分词的文档 token id 计算相关性分数，只对 query 分词
+    
+    Args:
+        model: CrossEncoder 模型
+        query: 查询文本
+        doc_tokens: 每个文档的 token id 序列（不含特殊 token）
+        batch_size: 推理批大小
+        model_name: 模型名称；指定时由自动调优器决定批大小
+    
+    Returns:
+        与 doc_tokens 一一对应的分数列表
+    """
+    tokenizer = model.tokenizer
+    query_ids = tokenizer(query, add_special_tokens=False)["input_ids"]
+    encoded = [
+        tokenizer.prepare_for_model(
+            query_ids, list(tokens), truncation="longest_first", max_length=model.max_length
+        )
+        for tokens in doc_tokens
+    ]
+    if model_name is not None:
+        return batch_autotuner.run(model_name, model, encoded, _forward_encoded)
+    return _forward_encoded(model, encoded, batch_size)
+
+
+def _forward_encoded(model: CrossEncoder, encoded: List, batch_size: int) -> List[float]:
+    """对已编码的输入按长度排序后分批前向计算"""
+    tokenizer = model.tokenizer
+    order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]["input_ids"]))
+    activation = _activation(model)
+    device = getattr(model, "device", None) or getattr(model, "_target_device", "cpu")
+    scores = [0.0] * len(encoded)
+    with live_profiler.operator_profile(), torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            features = tokenizer.pad([encoded[i] for i in batch], return_tensors="pt")
+            features = {name: tensor.to(device) for name, tensor in features.items()}
+            logits = activation(model.model(**features, return_dict=True).logits)
+            if logits.dim() == 2 and logits.shape[1] == 1:
+                logits = logits[:, 0]
+            for i, score in zip(batch, logits.float().cpu().tolist()):
+                scores[i] = float(score)
+    return scores
+
+
+def score_documents_with_tokens(
+    model: CrossEncoder,
+    query: str,
+    documents: List[str],
+    token_lookup: Dict[str, object],
+    model_name: Optional[str] = None
+) -> List[float]:
+    """有预先分词结果的文档跳过分词，其余文档走常规路径"""
+    tokenized = [i for i, doc in enumerate(documents) if doc in token_lookup]
+    plain = [i for i, doc in enumerate(documents) if doc not in token_lookup]
+    scores = [0.0] * len(documents)
+    if tokenized:
+        for i, score in zip(tokenized, score_token_pairs(
+            model, query, [token_lookup[documents[i]] for i in tokenized], model_name=model_name
+        )):
+            scores[i] = score
+    if plain:
+        for i, score in zip(plain, score_documents(model, query, [documents[i] for i in plain], model_name)):
+            scores[i] = score
+    return scores
+
+
+def score_documents(
+    model: CrossEncoder,
+    query: str,
+    documents: List[str],
+    model_name: Optional[str] = None
+) -> List[float]:
+    """用 cross-encoder 计算 query 与每个文档的相关性分数（指定 model_name 时启用自动调优）"""
+    return score_pairs(model, [[query, doc] for doc in documents], model_name=model_name)
+
+
+def score_late_interaction(
+    encoder: LateInteractionEncoder,
+    model_name: str,
+    query: str,
+    documents: List[str],
+    doc_ids: List[Optional[str]]
+) -> List[float]:
+    """
+    late-interaction 打分：已注册文档使用预先计算的 token 向量，其余文档现场编码
+    
+    Args:
+        encoder: 多向量编码器
+        model_name: 模型名称
+        query: 查询文本
+        documents: 文档文本
+        doc_ids: 每个文档对应的已注册文档 id（内联文本为 None）
+    
+    Returns:
+        与 documents 一一对应的 MaxSim 分数
+    """
+    stored = {}
+    if any(doc_ids):
+        stored = get_document_store().get_vectors([i for i in doc_ids if i], encoder_key(model_name))
+    missing = [i for i, doc_id in enumerate(doc_ids) if doc_id not in stored]
+    vectors = [stored.get(doc_id) for doc_id in doc_ids]
+    if missing:
+        for i, encoded in zip(missing, encoder.encode([documents[i] for i in missing])):
+            vectors[i] = encoded
+    return maxsim_scores(encoder.encode([query])[0], vectors)
+
+
+def check_model_accuracy(model_name: str, samples_path: Optional[str] = None) -> dict:
+    """
+    对比模型当前执行模式与 fp32 eager 基线的排序一致性
+    
+    Args:
+        model_name: 模型名称
+        samples_path: 样本 JSONL 文件，未指定时使用内置样本
+    
+    Returns:
+        排序一致性统计
+    """
+    samples = model_optimization.load_accuracy_samples(samples_path)
+    reference = load_single_model(model_name, overrides={"dtype": "float32", "compile": None})
+    candidate = load_single_model(model_name)
+    
+    reference_scores = [score_documents(reference, s["query"], s["documents"]) for s in samples]
+    candidate_scores = [score_documents(candidate, s["query"], s["documents"]) for s in samples]
+    
+    report = model_optimization.ranking_agreement(reference_scores, candidate_scores)
+    report["execution_mode"] = model_execution_modes[model_name]
+    return report
+
+
 @app.on_event("startup")
 async def load_model():
     """启动时加载默认模型"""
     global rerank_models, default_model_name
     try:
+        # 在加载模型之前应用线程数与核心绑定配置
+        cpu_tuning.configure_from_env()
+        
         # 默认加载 bge-reranker-large
         default_model_name = "BAAI/bge-reranker-large"
         
@@ -127,6 +613,25 @@ async def load_model():
         else:
             logger.info(f"⚠️  未设置 API Key，服务无需认证（不推荐生产环境）")
         
+        # 启动内存看门狗
+        if memory_watchdog.max_rss_bytes and not memory_watchdog.recycle and is_multi_worker():
+            logger.error(
+                f"🚨 已设置 RERANK_MAX_RSS_MB，但 uvicorn {uvicorn.__version__} 不会替换退出的 worker，"
+                "因此只回收内存、不会回收 worker。请升级到 uvicorn>=0.30.0，"
+                "或由 systemd / k8s 等负责重启时设置 RERANK_EXTERNAL_SUPERVISOR=1"
+            )
+        elif memory_watchdog.max_rss_bytes and not memory_watchdog.recycle:
+            logger.error(
+                "🚨 已设置 RERANK_MAX_RSS_MB，但当前为单进程部署：超过上限时退出会让整个服务停止且没有进程替换，"
+                "因此只回收内存、不会回收 worker。请使用 --workers 2 以上启动，"
+                "或由 systemd / k8s 等负责重启时设置 RERANK_EXTERNAL_SUPERVISOR=1"
+            )
+        memory_watchdog.start()
+        
+        # 多 worker 模式下接收其它 worker 转发的热替换请求（新启动的 worker 也会加载最新版本）
+        if is_multi_worker():
+            asyncio.ensure_future(watch_reload_broadcast())
+        
         logger.info(f"✅ 服务启动完成！支持 {len(SUPPORTED_MODELS)} 个模型")
         
     except Exception as e:
@@ -142,26 +647,168 @@ async def root():
         "loaded_models": list(rerank_models.keys()),
         "default_model": default_model_name,
         "supported_models": list(SUPPORTED_MODELS.keys()),
-        "authentication": "enabled" if API_KEY else "disabled"
+        "authentication": "enabled" if API_KEY else "disabled",
+        "runtime": cpu_tuning.effective_settings,
+        "admission": admission.stats(),
+        "dedup": pair_dedup.stats(),
+        "autotune": batch_autotuner.stats(),
+        "memory": memory_watchdog.stats(),
+        "document_store": document_store.stats() if document_store is not None else None,
+        "prefilter": {
+            "model": PREFILTER_MODEL,
+            "loaded": prefilter is not None,
+            "default_top_k": PREFILTER_TOP_K,
+            "cached_embeddings": len(prefilter.cache) if prefilter is not None else 0,
+            "audited_requests": prefilter_audit["audited_requests"],
+            "mean_recall_at_n": (
+                prefilter_audit["recall_sum"] / prefilter_audit["audited_requests"]
+                if prefilter_audit["audited_requests"] else None
+            )
+        }
     }
 
-@app.post("/v1/rerank", response_model=RerankResponse)
-async def rerank(
+def execute_rerank(
     request: RerankRequest,
-    authorized: bool = Depends(verify_api_key)
-):
+    model_name: str,
+    prefilter_top_k: int,
+    doc_ids: Optional[List[Optional[str]]] = None
+) -> RerankResponse:
     """
-    重排文档接口（兼容 VLLM 格式）
+    执行重排（同步，在线程池中运行）
     
     Args:
-        request: 包含 query、documents 和可选参数
-        authorized: API Key 验证结果
+        request: 重排请求（documents 已解析为文本）
+        model_name: 已校验的模型名称
+        prefilter_top_k: 预筛选保留的文档数，0 表示不预筛选
+        doc_ids: 每个文档对应的已注册文档 id（内联文本为 None）
     
     Returns:
-        重排后的文档列表（只包含 index 和 relevance_score）
+        重排结果
     """
-    global rerank_models, default_model_name
+    with use_rerank_model(model_name) as model:
+        return _execute_rerank(model, model_name, request, prefilter_top_k, doc_ids)
+
+
+def _execute_rerank(
+    model: CrossEncoder,
+    model_name: str,
+    request: RerankRequest,
+    prefilter_top_k: int,
+    doc_ids: Optional[List[Optional[str]]]
+) -> RerankResponse:
+    """用指定的模型实例执行预筛选、打分与排序"""
+    # 向量预筛选：只把与 query 最相似的 top K 个文档送入 cross-encoder
+    prefilter_stats = None
+    candidate_indices = list(range(len(request.documents)))
+    if prefilter_top_k > 0 and len(request.documents) > prefilter_top_k:
+        candidate_indices, stats = get_prefilter().select(
+            request.query, request.documents, prefilter_top_k
+        )
+        prefilter_stats = PrefilterStats(**stats)
+    
+    # late-interaction 打分：只编码 query，文档使用预先计算的 token 向量；不可用时退回 cross-encoder
+    scoring = "cross_encoder"
+    encoder = get_late_interaction_encoder(model_name) if request.scoring == "late_interaction" else None
+    if encoder is not None:
+        scoring = "late_interaction"
+        scores = score_late_interaction(
+            encoder,
+            model_name,
+            request.query,
+            [request.documents[i] for i in candidate_indices],
+            [doc_ids[i] if doc_ids else None for i in candidate_indices]
+        )
+    else:
+        # 已注册文档使用存储中预先分词的 token id，跳过文档分词
+        score_fn = partial(score_documents, model_name=model_name)
+        if doc_ids and any(doc_ids[i] for i in candidate_indices):
+            tokens = get_document_store().get_tokens(
+                [doc_ids[i] for i in candidate_indices if doc_ids[i]], tokenizer_key(model_name)
+            )
+            token_lookup = {
+                request.documents[i]: tokens[doc_ids[i]]
+                for i in candidate_indices if doc_ids[i] in tokens
+            }
+            if token_lookup:
+                score_fn = partial(score_documents_with_tokens, token_lookup=token_lookup, model_name=model_name)
     
+        # 计算相关性分数
+        scores = pair_dedup.score(
+            model, request.query, [request.documents[i] for i in candidate_indices], score_fn
+        )
+    
+    # 创建结果列表
+    results = [
+        RerankResultItem(
+            index=idx,
+            relevance_score=score
+        )
+        for idx, score in zip(candidate_indices, scores)
+    ]
+    
+    # 抽样审计：在后台对全部文档精排，计算预筛选的召回率，不占用本次请求的延迟；已有审计在运行时跳过
+    if (
+        prefilter_stats is not None
+        and scoring == "cross_encoder"
+        and random.random() < PREFILTER_AUDIT_RATE
+        and prefilter_audit_slot.acquire(blocking=False)
+    ):
+        n = request.top_n if request.top_n is not None and request.top_n > 0 else 10
+        kept_top = [r.index for r in sorted(results, key=lambda r: r.relevance_score, reverse=True)[:n]]
+        threading.Thread(
+            target=audit_prefilter_recall,
+            args=(model_name, request.query, list(request.documents), kept_top),
+            name="prefilter-audit",
+            daemon=True
+        ).start()
+    
+    # 按分数降序排序
+    results.sort(key=lambda x: x.relevance_score, reverse=True)
+    
+    # 如果指定了 top_n，只返回前 n 个
+    if request.top_n is not None and request.top_n > 0:
+        results = results[:request.top_n]
+    
+    return RerankResponse(
+        results=results,
+        prefilter=prefilter_stats,
+        scoring=scoring if request.scoring is not None else None
+    )
+
+
+def audit_prefilter_recall(model_name: str, query: str, documents: List[str], kept_top: List[int]):
+    """
+    后台审计一次预筛选：对全部文档精排，计算预筛选结果相对全量 top n 的召回率并计入累计值
+    
+    调用方已获取 prefilter_audit_slot，结束时释放。
+    """
+    try:
+        n = len(kept_top)
+        with use_rerank_model(model_name) as model:
+            # 不经过自动调优器，避免与在线请求合并批次、干扰调优统计
+            full_scores = score_documents(model, query, documents)
+        full_top = set(sorted(range(len(full_scores)), key=lambda i: full_scores[i], reverse=True)[:n])
+        recall = len(full_top & set(kept_top)) / len(full_top) if full_top else 1.0
+        with prefilter_audit_lock:
+            prefilter_audit["audited_requests"] += 1
+            prefilter_audit["recall_sum"] += recall
+        logger.info(f"🔍 预筛选召回率审计 - recall@{n}: {recall:.3f}")
+    except Exception as e:
+        logger.warning(f"⚠️  预筛选召回率审计失败: {str(e)}")
+    finally:
+        prefilter_audit_slot.release()
+
+
+async def process_rerank(request: RerankRequest) -> RerankResponse:
+    """
+    处理一个重排请求（HTTP 与 WebSocket 共用）
+    
+    Args:
+        request: 包含 query、documents 和可选参数
+    
+    Returns:
+        重排结果；失败时抛出 HTTPException
+    """
     if not request.documents:
         raise HTTPException(status_code=400, detail="文档列表不能为空")
     
@@ -176,41 +823,53 @@ async def rerank(
                 detail=f"不支持的模型: {model_name}. 支持的模型: {list(SUPPORTED_MODELS.keys())}"
             )
         
-        # 如果模型未加载，动态加载
-        if model_name not in rerank_models:
-            logger.info(f"🔄 模型 [{model_name}] 未加载，正在动态加载...")
-            rerank_models[model_name] = load_single_model(model_name)
+        if request.scoring is not None and request.scoring not in SCORING_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支持的打分方式: {request.scoring}. 支持的打分方式: {list(SCORING_MODES)}"
+            )
+        
+        # 把已注册文档的引用解析为文本
+        doc_ids = [d.id if isinstance(d, DocumentRef) else None for d in request.documents]
+        if any(doc_id is not None for doc_id in doc_ids):
+            stored_texts = iter(await run_in_threadpool(
+                get_document_store().get_texts, [i for i in doc_ids if i is not None]
+            ))
+            resolved = [
+                next(stored_texts) if doc_id is not None else doc
+                for doc_id, doc in zip(doc_ids, request.documents)
+            ]
+            missing = [doc_id for doc_id, text in zip(doc_ids, resolved) if doc_id is not None and text is None]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"文档不存在: {missing[:10]}")
+            request.documents = resolved
+        
+        prefilter_top_k = request.prefilter_top_k if request.prefilter_top_k is not None else PREFILTER_TOP_K
         
-        model = rerank_models[model_name]
+        # 估算请求成本（启用预筛选时只计入最终进入 cross-encoder 的文档数）；文档很多时耗时不可忽略，放到线程池执行
+        cost = await run_in_threadpool(
+            estimate_cost,
+            request.query,
+            request.documents,
+            SUPPORTED_MODELS[model_name]["max_length"],
+            limit=prefilter_top_k if prefilter_top_k > 0 else None
+        )
         
         logger.info(
             f"收到重排请求 - query: '{request.query[:50]}...', "
             f"documents: {len(request.documents)}个, "
             f"model: {model_name}, "
-            f"top_n: {request.top_n}"
+            f"top_n: {request.top_n}, "
+            f"scoring: {request.scoring or 'cross_encoder'}, "
+            f"cost: {cost}"
         )
         
-        # 准备模型输入
-        pairs = [[request.query, doc] for doc in request.documents]
-        
-        # 计算相关性分数
-        scores = model.predict(pairs)
-        
-        # 创建结果列表
-        results = [
-            RerankResultItem(
-                index=idx,
-                relevance_score=float(score)
-            )
-            for idx, score in enumerate(scores)
-        ]
-        
-        # 按分数降序排序
-        results.sort(key=lambda x: x.relevance_score, reverse=True)
-        
-        # 如果指定了 top_n，只返回前 n 个
-        if request.top_n is not None and request.top_n > 0:
-            results = results[:request.top_n]
+        # 准入控制：在途成本超出预算时排队或拒绝；推理在线程池中执行，不阻塞事件循环，
+        # 请求被取消时成本一直占用到推理线程结束
+        response = await admission.run(
+            cost, lambda: run_in_threadpool(execute_rerank, request, model_name, prefilter_top_k, doc_ids)
+        )
+        results = response.results
         
         # 记录最终返回的索引与分数
         try:
@@ -224,17 +883,330 @@ async def rerank(
         except Exception:
             logger.info(f"✅ 重排完成，返回 {len(results)} 个结果（使用模型: {model_name}）")
         
-        return RerankResponse(results=results)
+        return response
     
+    except AdmissionRejected as e:
+        logger.warning(f"🚦 请求未被准入: {e.detail}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"❌ 重排失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"重排失败: {str(e)}")
 
+@app.post("/v1/rerank", response_model=RerankResponse, response_model_exclude_none=True)
+async def rerank(
+    request: RerankRequest,
+    authorized: bool = Depends(verify_api_key)
+):
+    """
+    重排文档接口（兼容 VLLM 格式）
+    
+    Args:
+        request: 包含 query、documents 和可选参数
+        authorized: API Key 验证结果
+    
+    Returns:
+        重排后的文档列表（只包含 index 和 relevance_score）
+    """
+    return await process_rerank(request)
+
+def _ws_token_valid(token: Optional[str]) -> bool:
+    """校验 WebSocket 连接携带的 API Key"""
+    if not API_KEY:
+        return True
+    if token and token.startswith("Bearer "):
+        token = token[7:]
+    return token == API_KEY
+
+@app.websocket("/v1/rerank/ws")
+async def rerank_websocket(websocket: WebSocket):
+    """
+    持久化 WebSocket 重排通道
+    
+    连接时认证一次（握手的 Authorization 头，或第一条消息 {"type": "auth", "api_key": "..."}），
+    之后可以连续发送多个重排消息：
+        {"id": "req-1", "query": "...", "documents": [...], "top_n": 3, "model": "..."}
+    每个消息独立处理，完成即返回（可能乱序），用 id 对应：
+        {"id": "req-1", "results": [...]}
+        {"id": "req-2", "error": {"status_code": 400, "detail": "..."}}
+    """
+    await websocket.accept()
+    
+    if not _ws_token_valid(websocket.headers.get("authorization")):
+        try:
+            message = await asyncio.wait_for(websocket.receive_json(), timeout=10)
+        except Exception:
+            await websocket.close(code=1008)
+            return
+        if (
+            not isinstance(message, dict)
+            or message.get("type") != "auth"
+            or not _ws_token_valid(message.get("api_key"))
+        ):
+            await websocket.send_json({"type": "auth", "error": {"status_code": 401, "detail": "无效的 API Key"}})
+            await websocket.close(code=1008)
+            return
+        await websocket.send_json({"type": "auth", "status": "ok"})
+    
+    send_lock = asyncio.Lock()
+    inflight = asyncio.Semaphore(WS_MAX_INFLIGHT)  # 单连接在途消息上限，超过时暂停读取（背压）
+    tasks = set()
+    
+    async def send(payload: dict):
+        async with send_lock:
+            await websocket.send_json(payload)
+    
+    async def handle(frame):
+        message_id = None
+        try:
+            # 每帧单独解析：格式错误只影响这一条消息，不会中断连接上的其它请求
+            try:
+                message = json.loads(frame)
+            except ValueError as e:
+                await send({"id": None, "error": {"status_code": 400, "detail": f"无效的 JSON: {str(e)}"}})
+                return
+            if not isinstance(message, dict):
+                await send({"id": None, "error": {"status_code": 400, "detail": "消息必须是 JSON 对象"}})
+                return
+            message_id = message.pop("id", None)
+            request = RerankRequest(**message)
+            response = await process_rerank(request)
+            await send({"id": message_id, **jsonable_encoder(response, exclude_none=True)})
+        except ValidationError as e:
+            await send({"id": message_id, "error": {"status_code": 422, "detail": str(e)}})
+        except HTTPException as e:
+            await send({"id": message_id, "error": {"status_code": e.status_code, "detail": e.detail}})
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            await send({"id": message_id, "error": {"status_code": 400, "detail": f"无效的消息: {str(e)}"}})
+        finally:
+            inflight.release()
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            frame = message.get("text")
+            if frame is None:
+                frame = message.get("bytes") or b""
+            await inflight.acquire()
+            task = asyncio.ensure_future(handle(frame))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning(f"⚠️  WebSocket 连接异常关闭: {str(e)}")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def register_documents(request: DocumentRegisterRequest) -> dict:
+    """写入文档存储，并为指定模型预先分词"""
+    model_names = request.models or [default_model_name]
+    for model_name in model_names:
+        if model_name not in SUPPORTED_MODELS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支持的模型: {model_name}. 支持的模型: {list(SUPPORTED_MODELS.keys())}"
+            )
+    
+    tokenizers = {}
+    for model_name in model_names:
+        with use_rerank_model(model_name) as model:
+            tokenizers[tokenizer_key(model_name)] = partial(
+                lambda texts, tokenizer, max_length: tokenizer(
+                    texts, add_special_tokens=False, truncation=True, max_length=max_length
+                )["input_ids"],
+                tokenizer=model.tokenizer,
+                max_length=model.max_length
+            )
+    
+    # 预先计算 late-interaction 文档向量（同一编码器只计算一次）
+    encoders, vectors_for = {}, []
+    if request.late_interaction:
+        for model_name in model_names:
+            encoder = get_late_interaction_encoder(model_name, wait=True)
+            if encoder is not None and encoder_key(model_name) not in encoders:
+                encoders[encoder_key(model_name)] = encoder.encode
+                vectors_for.append(model_name)
+    
+    count = get_document_store().put_many([(d.id, d.text) for d in request.documents], tokenizers, encoders)
+    logger.info(f"📚 注册文档 {count} 个，预先分词模型: {model_names}，预先计算向量模型: {vectors_for}")
+    return {"registered": count, "tokenized_for": model_names, "vectors_for": vectors_for}
+
+@app.post("/v1/documents")
+async def create_documents(
+    request: DocumentRegisterRequest,
+    authorized: bool = Depends(verify_api_key)
+):
+    """
+    批量注册文档
+    
+    文档持久化到服务端的磁盘存储并预先分词，之后 /v1/rerank 可以用 {"id": "..."} 引用，
+    无需在每次请求中传输全文。
+    """
+    if not request.documents:
+        raise HTTPException(status_code=400, detail="文档列表不能为空")
+    return await run_in_threadpool(register_documents, request)
+
+@app.get("/v1/admission")
+async def admission_status():
+    """准入控制的预算与当前使用情况（供网关路由参考）"""
+    return admission.stats()
+
+def is_multi_worker() -> bool:
+    return int(os.getenv(cpu_tuning.WORKERS_ENV, "1") or 1) > 1
+
+
+def start_reload(model_name: str, version: str, local_path: Optional[str]):
+    """标记加载状态并在后台线程中热替换"""
+    rerank_models.set_pending(model_name, version, "loading")
+    threading.Thread(
+        target=reload_model_in_background,
+        args=(model_name, version, local_path),
+        name=f"reload-{model_name}",
+        daemon=True
+    ).start()
+
+
+async def watch_reload_broadcast():
+    """多 worker 模式：轮询共享文件，应用其它 worker 收到的热替换请求"""
+    while True:
+        await asyncio.sleep(MODEL_RELOAD_POLL_INTERVAL)
+        try:
+            for model_name, reload_request in model_reload_broadcast.read().items():
+                if model_name not in SUPPORTED_MODELS:
+                    continue
+                status = rerank_models.status(model_name)
+                known_versions = [
+                    status["current"]["version"] if status["current"] else None,
+                    status["pending"]["version"] if status["pending"] else None,
+                ]
+                if reload_request["version"] in known_versions:
+                    continue
+                logger.info(f"📡 收到广播的热替换请求 [{model_name}] -> 版本 {reload_request['version']}")
+                start_reload(model_name, reload_request["version"], reload_request.get("local_path"))
+        except Exception as e:
+            logger.error(f"❌ 读取热替换广播失败: {str(e)}")
+
+
+def reload_model_in_background(model_name: str, version: str, local_path: Optional[str]):
+    """
+    后台加载并预热模型新版本，原子替换后等待旧版本的在途请求结束再释放
+    
+    任何一步失败时旧版本继续服务，失败原因记录在 /v1/models 的 pending 字段中。
+    """
+    try:
+        rerank_models.set_pending(model_name, version, "loading")
+        overrides = {"local_path": local_path} if local_path else None
+        model = load_single_model(model_name, overrides=overrides)
+        
+        rerank_models.set_pending(model_name, version, "warming")
+        score_documents(model, "warmup", ["warmup document"] * 4)
+        
+        # 与冷启动加载互斥：否则并发的 use_rerank_model 可能在切换后用旧权重覆盖新版本
+        with model_load_lock:
+            previous = rerank_models.swap(model_name, model, version)
+        logger.info(f"🔁 模型 [{model_name}] 已切换到版本 {version}")
+        # 新版本的最佳批大小可能不同，重新调优
+        batch_autotuner.reset(model_name)
+        
+        if previous is not None:
+            drained = rerank_models.release_when_drained(model_name, previous, timeout=MODEL_DRAIN_TIMEOUT)
+            if drained:
+                logger.info(f"♻️  模型 [{model_name}] 旧版本 {previous.version} 已排空并释放")
+            else:
+                logger.warning(f"⚠️  模型 [{model_name}] 旧版本 {previous.version} 排空超时，已强制释放")
+            # 把旧权重占用的内存归还给操作系统
+            memory_watchdog.trim()
+    except Exception as e:
+        logger.error(f"❌ 模型 [{model_name}] 版本 {version} 加载失败: {str(e)}")
+        rerank_models.set_pending(model_name, version, "failed", error=str(e))
+
+
+@app.post("/admin/models/reload", status_code=202)
+async def reload_model(
+    request: ModelReloadRequest,
+    authorized: bool = Depends(verify_admin_key)
+):
+    """
+    热替换模型（管理接口）
+    
+    在后台加载并预热新版本，完成后原子切换，旧版本排空后释放，期间请求不受影响。
+    进度可通过 GET /v1/models 查看。多 worker 部署时请求会广播给所有 worker，
+    各 worker 在轮询间隔内各自加载，/v1/models 只反映处理该查询的 worker 的状态。
+    """
+    if request.model not in SUPPORTED_MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的模型: {request.model}. 支持的模型: {list(SUPPORTED_MODELS.keys())}"
+        )
+    
+    if request.local_path and not os.path.isdir(request.local_path):
+        raise HTTPException(status_code=400, detail=f"模型目录不存在: {request.local_path}")
+    
+    pending = rerank_models.pending(request.model)
+    if pending and pending["state"] in ("loading", "warming"):
+        raise HTTPException(status_code=409, detail=f"模型 {request.model} 正在加载版本 {pending['version']}")
+    
+    version = request.version or new_version()
+    start_reload(request.model, version, request.local_path)
+    if is_multi_worker():
+        model_reload_broadcast.publish(request.model, version, request.local_path)
+    
+    logger.info(f"🔄 开始热替换模型 [{request.model}] -> 版本 {version}")
+    return {
+        "model": request.model,
+        "version": version,
+        "state": "loading",
+        "broadcast": is_multi_worker()
+    }
+
+@app.post("/admin/profile")
+async def capture_profile(
+    seconds: float = Query(10, gt=0, le=MAX_CAPTURE_SECONDS, description="采集时长（秒）"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Python 调用栈采样间隔（毫秒）"),
+    allocations: bool = Query(True, description="是否记录内存分配（tracemalloc，有一定开销）"),
+    authorized: bool = Depends(verify_admin_key)
+):
+    """
+    在线性能剖析（管理接口）
+    
+    对运行中的进程采集指定时长，返回 zip 文件，包含 Python 调用栈采样（折叠格式）、
+    CrossEncoder 前向计算的 torch 算子耗时和内存分配统计。
+    """
+    try:
+        live_profiler.start(interval=interval_ms / 1000, trace_allocations=allocations)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    logger.info(f"🔬 开始在线剖析，时长 {seconds} 秒")
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        artifact = await run_in_threadpool(live_profiler.stop)
+    logger.info(f"🔬 在线剖析完成，结果 {len(artifact) / 1024:.1f} KiB")
+    
+    filename = f"rerank-profile-{os.getpid()}-{int(time.time())}.zip"
+    return Response(
+        content=artifact,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/v1/models")
 async def list_models():
     """列出可用的模型"""
+    autotune_stats = batch_autotuner.stats()
+    late_interaction = {name: late_interaction_status(name) for name in SUPPORTED_MODELS}
     return {
         "data": [
             {
@@ -242,17 +1214,82 @@ async def list_models():
                 "object": "model",
                 "owned_by": "BAAI" if "BAAI" in model_name else "unknown",
                 "loaded": model_name in rerank_models,
+                **rerank_models.status(model_name),
+                "execution_mode": model_execution_modes.get(model_name),
+                "autotune": autotune_stats.get(model_name),
+                "scoring_modes": ["cross_encoder"] + (
+                    ["late_interaction"]
+                    if late_interaction.get(model_name) and late_interaction[model_name]["state"] != "failed"
+                    else []
+                ),
+                "late_interaction": late_interaction.get(model_name),
                 "local_available": os.path.exists(config["local_path"])
             }
             for model_name, config in SUPPORTED_MODELS.items()
         ]
     }
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="VLLM Rerank API 服务")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--workers", type=int, help="uvicorn worker 进程数")
+    parser.add_argument("--intra-op-threads", type=int, help="每个 worker 的 torch 算子内线程数")
+    parser.add_argument("--inter-op-threads", type=int, help="每个 worker 的 torch 算子间线程数")
+    parser.add_argument(
+        "--cpu-affinity",
+        help='核心绑定："auto" 在 worker 间平分核心，或用 ";" 分隔每个 worker 的核心列表，如 "0-3;4-7"'
+    )
+    parser.add_argument("--benchmark", action="store_true", help="扫描线程配置并推荐最佳参数，不启动服务")
+    parser.add_argument("--benchmark-model", default="BAAI/bge-reranker-large", help="基准测试使用的模型")
+    parser.add_argument("--benchmark-docs", type=int, default=64, help="基准测试每次请求的文档数")
+    parser.add_argument("--check-accuracy", metavar="MODEL", help="对比模型配置的执行模式与 fp32 基线的排序一致性，不启动服务")
+    parser.add_argument("--accuracy-samples", help="精度校验样本 JSONL 文件（每行包含 query 与 documents）")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    # 启动服务（默认端口 8000，兼容 VLLM）
-    uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=8000,
-        log_level="info"
-    )
\ No newline at end of file
+    args = parse_args()
+    
+    # 写入环境变量，uvicorn 多 worker 模式下子进程会继承这些配置
+    for env_name, value in [
+        (cpu_tuning.WORKERS_ENV, args.workers),
+        (cpu_tuning.INTRA_OP_THREADS_ENV, args.intra_op_threads),
+        (cpu_tuning.INTER_OP_THREADS_ENV, args.inter_op_threads),
+        (cpu_tuning.CPU_AFFINITY_ENV, args.cpu_affinity),
+        (cpu_tuning.INSTANCE_ID_ENV, os.getenv(cpu_tuning.INSTANCE_ID_ENV) or f"port-{args.port}"),
+        (LAUNCH_ID_ENV, uuid.uuid4().hex),
+    ]:
+        if value is not None:
+            os.environ[env_name] = str(value)
+    
+    if args.check_accuracy:
+        report = check_model_accuracy(args.check_accuracy, args.accuracy_samples)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif args.benchmark:
+        results = cpu_tuning.benchmark_thread_configs(
+            load_single_model,
+            args.benchmark_model,
+            num_docs=args.benchmark_docs
+        )
+        cpu_tuning.print_benchmark_report(results)
+    else:
+        workers = int(os.getenv(cpu_tuning.WORKERS_ENV, "1") or 1)
+        if os.getenv(cpu_tuning.CPU_AFFINITY_ENV, "").strip() == "auto":
+            usable_cores = len(cpu_tuning.available_cores())
+            if workers > usable_cores:
+                logger.warning(
+                    f"⚠️  --cpu-affinity auto 下 worker 数 ({workers}) 超过可用核心数 ({usable_cores})，"
+                    f"worker 数减少为 {usable_cores}"
+                )
+                workers = usable_cores
+                os.environ[cpu_tuning.WORKERS_ENV] = str(workers)
+        # 启动服务（默认端口 8000，兼容 VLLM）
+        uvicorn.run(
+            "rerank_server:app" if workers > 1 else app,
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            log_level="info"
+        )
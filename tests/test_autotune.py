@@ -0,0 +1,96 @@
+"""BatchAutotuner 合并推理测试（用线程模拟并发请求，不加载模型）"""
+
+import threading
+
+import pytest
+
+from autotune import BatchAutotuner
+
+MODEL = object()
+
+
+def merging_autotuner(batch_size: int) -> BatchAutotuner:
+    """初始等待时间为 0，直接把等待时间调到最长，使并发的小请求一定会合并"""
+    autotuner = BatchAutotuner([batch_size], initial_batch_size=batch_size, max_wait_seconds=1.0)
+    tuner = autotuner.tuner("model")
+    tuner.wait_index = len(tuner.wait_steps) - 1
+    return autotuner
+
+
+def run_concurrently(autotuner, jobs, score_fn):
+    """每个 job 一个线程同时调用 run()，返回 (结果, 异常) 列表"""
+    barrier = threading.Barrier(len(jobs))
+    results = [None] * len(jobs)
+    errors = [None] * len(jobs)
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = autotuner.run("model", MODEL, jobs[i], score_fn)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(jobs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results, errors
+
+
+def test_merged_batch_returns_each_job_its_own_scores():
+    calls = []
+    lock = threading.Lock()
+
+    def score_fn(model, items, batch_size):
+        with lock:
+            calls.append(list(items))
+        return [float(item) for item in items]
+
+    autotuner = merging_autotuner(8)
+    jobs = [[i * 10, i * 10 + 1] for i in range(4)]
+    results, errors = run_concurrently(autotuner, jobs, score_fn)
+
+    assert errors == [None] * 4
+    assert results == [[float(item) for item in job] for job in jobs]
+    # 4 个小请求凑满一批，合并为一次推理
+    assert len(calls) == 1
+    assert sorted(calls[0]) == sorted(item for job in jobs for item in job)
+
+
+def test_exception_reaches_every_merged_job():
+    def score_fn(model, items, batch_size):
+        raise ValueError("forward failed")
+
+    autotuner = merging_autotuner(8)
+    results, errors = run_concurrently(autotuner, [[1, 2]] * 4, score_fn)
+
+    assert results == [None] * 4
+    assert all(isinstance(e, ValueError) and str(e) == "forward failed" for e in errors)
+
+
+def test_fixed_batch_size_when_disabled():
+    batch_sizes = []
+
+    def score_fn(model, items, batch_size):
+        batch_sizes.append(batch_size)
+        return [0.0] * len(items)
+
+    autotuner = BatchAutotuner([4, 8, 16], initial_batch_size=48, window=2, enabled=False)
+    for size in (100, 2, 100, 7, 100):
+        assert autotuner.run("model", MODEL, list(range(size)), score_fn) == [0.0] * size
+
+    assert batch_sizes == [48] * 5
+    assert autotuner.tuner("model").batch_size == 48
+    assert autotuner.tuner("model").wait_seconds == 0
+
+
+def test_reset_discards_tuning_state():
+    autotuner = BatchAutotuner([4, 8], initial_batch_size=8)
+    tuner = autotuner.tuner("model")
+    autotuner.reset("model")
+    assert autotuner.tuner("model") is not tuner
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,112 @@
+"""PairSingleFlight 去重测试（用线程模拟并发请求，不加载模型）"""
+
+import threading
+
+import pytest
+
+from dedup import PairSingleFlight
+
+MODEL = object()
+
+
+def test_duplicates_in_one_request_are_scored_once():
+    calls = []
+
+    def score_fn(model, query, documents):
+        calls.append(list(documents))
+        return [float(len(doc)) for doc in documents]
+
+    single_flight = PairSingleFlight()
+    scores = single_flight.score(MODEL, "q", ["bb", "a", "bb", "ccc", "a"], score_fn)
+
+    assert scores == [2.0, 1.0, 2.0, 3.0, 1.0]
+    assert calls == [["bb", "a", "ccc"]]
+    assert single_flight.stats()["deduplicated_pairs"] == 2
+    assert single_flight.stats()["inflight_pairs"] == 0
+
+
+def start_blocked_leader(single_flight, fail=False):
+    """启动一个在 score_fn 中阻塞的请求，返回 (线程, 放行事件, 结果)"""
+    entered = threading.Event()
+    release = threading.Event()
+    outcome = {}
+
+    def score_fn(model, query, documents):
+        entered.set()
+        release.wait(timeout=10)
+        if fail:
+            raise RuntimeError("leader failed")
+        return [float(len(doc)) for doc in documents]
+
+    def leader():
+        try:
+            outcome["scores"] = single_flight.score(MODEL, "q", ["a", "bb"], score_fn)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    assert entered.wait(timeout=10)
+    return thread, release, outcome
+
+
+def run_follower(single_flight, documents, calls):
+    outcome = {}
+
+    def score_fn(model, query, docs):
+        calls.append(list(docs))
+        return [float(len(doc)) for doc in docs]
+
+    def follower():
+        try:
+            outcome["scores"] = single_flight.score(MODEL, "q", documents, score_fn)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    return thread, outcome
+
+
+def test_concurrent_requests_join_inflight_pairs():
+    single_flight = PairSingleFlight()
+    leader, release, leader_outcome = start_blocked_leader(single_flight)
+
+    calls = []
+    follower, follower_outcome = run_follower(single_flight, ["bb", "cccc"], calls)
+    follower.join(timeout=0.2)
+    assert follower.is_alive()  # 等待 leader 正在计算的 "bb"
+
+    release.set()
+    leader.join(timeout=10)
+    follower.join(timeout=10)
+
+    assert leader_outcome["scores"] == [1.0, 2.0]
+    assert follower_outcome["scores"] == [2.0, 4.0]
+    assert calls == [["cccc"]]
+    stats = single_flight.stats()
+    assert stats["computed_pairs"] == 3
+    assert stats["joined_pairs"] == 1
+    assert stats["inflight_pairs"] == 0
+
+
+def test_leader_exception_reaches_followers():
+    single_flight = PairSingleFlight()
+    leader, release, leader_outcome = start_blocked_leader(single_flight, fail=True)
+
+    followers = [run_follower(single_flight, ["a"], []) for _ in range(3)]
+    release.set()
+    leader.join(timeout=10)
+    for thread, _ in followers:
+        thread.join(timeout=10)
+
+    assert isinstance(leader_outcome["error"], RuntimeError)
+    for _, outcome in followers:
+        assert isinstance(outcome["error"], RuntimeError)
+        assert str(outcome["error"]) == "leader failed"
+    # 失败的结果不会被后续请求复用
+    assert single_flight.score(MODEL, "q", ["a"], lambda model, query, docs: [9.0]) == [9.0]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])